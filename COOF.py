@@ -5,17 +5,32 @@
 
 # --- 0. Importar Bibliotecas Necessárias ---
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-import numpy as np
+import pandas as pd
 import os
+import json
+import collections
+import functools
+import threading
+import cachetools
+
+# --- Núcleo de dados (carregamento, filtros, agregação e formatação, sem Streamlit) ---
+from coof_core import (
+    TESOURO_STREAMING, DATASET_DIR, DATA_DIR, INCREMENTAL_STORE_DIR, DIAGNOSTICS,
+    load_tesouro_data, load_merged_dataset, refresh_data_dir, sync_partitioned_dataset, dataset_version,
+    CubeBackend, ParquetDatasetBackend, selection_hash,
+    SHARED_CACHE_URL, PREWARM_SELECTIONS, open_shared_cache, shared_view, prewarm_shared_cache,
+    to_reais, format_currency, format_table, prepare_bar_data, prepare_pie_data,
+    DETAIL_PAGE_SIZES, DETAIL_SORT_OPTIONS, sort_po_detail, search_po_detail, detail_page_count, format_detail_page,
+    normalize_prompt, build_llm_context,
+    begin_run, end_run, current_run, stage,
+)
 
-# --- Importações para o Chatbot (DIRETO) ---
-try:
-    import google.generativeai as genai
-    GEMINI_INSTALLED = True
-except ImportError:
-    GEMINI_INSTALLED = False
+# --- Chatbot: cliente do modelo (Gemini ou stub local), com streaming, prazo e novas tentativas ---
+from coof_llm import (
+    GEMINI_INSTALLED, LLM_STUB, LLMBlockedError, LLMTimeoutError,
+    GeminiClient, StubLLMClient, stream_with_timeout,
+)
 # -------------------------------------------
 
 # Certifique-se de que 'openpyxl' está instalado
@@ -35,89 +50,189 @@ if "messages" not in st.session_state:
     st.session_state.messages = [] # Mantém para o histórico do chat
 # -----------------------------------------
 
+# --- Diagnóstico de Desempenho (COOF_DIAGNOSTICS=1) ---
+# Cada rerun vira uma execução com as etapas medidas (coof_core.stage); st.stop passa por stop_script
+# e uma execução interrompida por novo rerun é encerrada no rerun seguinte. As últimas ficam na
+# sessão para o painel.
+DIAGNOSTICS_HISTORY = 20
+
+def finish_diagnostics(run, interrompida=False):
+    resumo = end_run(run, interrompida)
+    if resumo is not None: st.session_state.diag_execucoes.append(resumo)
+
+def diagnosed_fragment(nome):
+    # Dentro de uma execução completa o fragmento é só mais uma etapa; reexecutado sozinho
+    # (botão, chat) ele abre a própria execução
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not DIAGNOSTICS or current_run() is not None:
+                with stage(nome): return func(*args, **kwargs)
+            run = begin_run(f"fragmento:{nome}")
+            try:
+                with run.stage(nome): return func(*args, **kwargs)
+            finally: finish_diagnostics(run)
+        return wrapper
+    return decorator
+
+def render_diagnostics_panel(execucoes):
+    ultima = next((e for e in reversed(execucoes) if e['tipo'] == 'completa'), None)
+    if ultima is not None:
+        rss = f"; pico de memória do processo: {ultima['rss_pico_mb']} MB" if ultima['rss_pico_mb'] is not None else ""
+        st.caption(f"Última execução: {ultima['duracao_ms']:.0f} ms{rss}.")
+        etapas = pd.DataFrame(sorted(ultima['etapas'], key=lambda r: r['inicio_ms']))
+        etapas['etapa'] = ['· ' * n + nome for n, nome in zip(etapas['nivel'], etapas['etapa'])]
+        colunas = [c for c in ['etapa', 'duracao_ms', 'pico_memoria_kb', 'linhas', 'erro'] if c in etapas.columns]
+        st.dataframe(etapas[colunas], hide_index=True, use_container_width=True)
+    fragmentos = [e for e in execucoes if e['tipo'] != 'completa']
+    if fragmentos:
+        st.caption("Fragmentos recentes: " + '; '.join(f"{e['tipo'].split(':')[-1]} {e['duracao_ms']:.0f} ms" for e in fragmentos[-5:]))
+    st.download_button("Exportar diagnóstico (JSON)", data=json.dumps(list(execucoes), ensure_ascii=False, indent=1, default=str),
+                       file_name='coof_diagnostico.json', mime='application/json')
+
+diag_run = None
+if DIAGNOSTICS:
+    if 'diag_execucoes' not in st.session_state:
+        st.session_state.diag_execucoes = collections.deque(maxlen=DIAGNOSTICS_HISTORY)
+    if st.session_state.get('diag_ativa') is not None: finish_diagnostics(st.session_state.diag_ativa, interrompida=True)
+    diag_run = st.session_state.diag_ativa = begin_run('completa')
+
+def stop_script():
+    # st.stop() que antes encerra a execução diagnosticada: aberta, ela manteria o tracemalloc
+    # ligado para o processo inteiro até um novo rerun desta sessão
+    if diag_run is not None and not diag_run.finalizada:
+        finish_diagnostics(diag_run, interrompida=True)
+        st.session_state.diag_ativa = None
+    st.stop()
+
 # --- 2. Função para Carregamento e Preparação dos Dados ---
+# A leitura e o tratamento ficam em coof_core.py; aqui são adicionados o cache do Streamlit e as mensagens.
+DATA_DIR_REFRESH_TTL = 60 # segundos entre verificações do diretório de extratos
+# Versões dos dados mantidas em cache (a atual e a anterior, enquanto sessões abertas trocam de versão);
+# sem limite, cada atualização dos extratos deixaria uma cópia completa do histórico (e do cubo) em memória
+DATA_VERSIONS_KEPT = 2
+
+@st.cache_resource(show_spinner=False)
+def get_shared_cache():
+    # Cache compartilhado entre processos/réplicas (COOF_SHARED_CACHE); None quando desativado
+    return open_shared_cache(SHARED_CACHE_URL)
+
 @st.cache_data
-def load_and_process_tesouro_data(file_path):
-    # ... (Conteúdo da função load_and_process_tesouro_data permanece EXATAMENTE O MESMO da versão anterior)
-    # ... (Ele garante que df e anos_disponiveis sejam retornados corretamente)
-    df_local = None
-    anos_disponiveis_local = []
-    tesouro_cols_new = [
-        'Ano_Orcamento', 'Acao_Codigo', 'Acao_Nome', 'PO_Codigo', 'PO_Nome',
-        'GND_Codigo', 'RP_Codigo', 'RP_Nome', 'Fonte_Codigo', 'PTRES',
-        'Dotacao_Lei_Creditos', 'Valor_Empenhado', 'Valor_Liquidado', 'Valor_Pago'
-    ]
-    dtype_map = {}
-    cols_to_str = ['RP_Codigo', 'Fonte_Codigo', 'Acao_Codigo', 'PO_Codigo', 'GND_Codigo', 'PTRES']
-    for col_name in cols_to_str:
-        if col_name in tesouro_cols_new:
-            try:
-                col_index = tesouro_cols_new.index(col_name)
-                dtype_map[col_index] = str
-            except ValueError:
-                 print(f"Aviso interno: Coluna '{col_name}' não encontrada via index.")
-        else:
-            print(f"Aviso: Coluna '{col_name}' definida para string não encontrada.")
+def load_and_process_tesouro_data(file_path, streaming=TESOURO_STREAMING):
     try:
-        df_local = pd.read_excel(file_path, header=0, usecols=range(len(tesouro_cols_new)), dtype=dtype_map)
-        df_local.columns = tesouro_cols_new
-        currency_cols_tesouro = ['Dotacao_Lei_Creditos', 'Valor_Empenhado', 'Valor_Liquidado', 'Valor_Pago']
-        for col in currency_cols_tesouro:
-            if col in df_local.columns:
-                if not pd.api.types.is_numeric_dtype(df_local[col]):
-                    df_local[col] = df_local[col].astype(str).str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
-                df_local[col] = pd.to_numeric(df_local[col], errors='coerce')
-            else: df_local[col] = 0
-        df_local[currency_cols_tesouro] = df_local[currency_cols_tesouro].fillna(0)
-        if 'Valor_Empenhado' in df_local.columns and 'Valor_Liquidado' in df_local.columns:
-            df_local['Saldo_Empenho'] = df_local['Valor_Empenhado'] - df_local['Valor_Liquidado']
-        else: df_local['Saldo_Empenho'] = 0
-        if 'Dotacao_Lei_Creditos' in df_local.columns and 'Valor_Empenhado' in df_local.columns:
-            df_local['Saldo_a_Empenhar'] = df_local['Dotacao_Lei_Creditos'] - df_local['Valor_Empenhado']
-        else: df_local['Saldo_a_Empenhar'] = 0
-        year_col = 'Ano_Orcamento'
-        if year_col in df_local.columns:
-            df_local[year_col] = pd.to_numeric(df_local[year_col], errors='coerce')
-            df_local[year_col] = df_local[year_col].fillna(0).astype(int)
-            anos_disponiveis_local = sorted(df_local[year_col][df_local[year_col] != 0].unique())
-            if not anos_disponiveis_local: st.warning(f"Nenhum ano válido (>0) encontrado.")
-        else:
-            st.error(f"ERRO CRÍTICO: Coluna '{year_col}' não encontrada.")
-            return None, []
-        str_cols_to_clean = ['Acao_Nome', 'PO_Nome', 'RP_Nome']
-        for col in str_cols_to_clean:
-            if col in df_local.columns: df_local[col] = df_local[col].astype(str).str.strip()
-        return df_local, anos_disponiveis_local
-    except FileNotFoundError: st.error(f"Erro: Arquivo '{file_path}' não encontrado."); return None, []
-    except ValueError as e: st.error(f"Erro ao ler '{file_path}'. Verifique 'tesouro_cols_new'. Detalhe: {e}"); return None, []
-    except Exception as e: st.error(f"Erro inesperado: {e}"); return None, []
-
-
-# --- 3. Função de Formatação de Moeda ---
-def format_currency(value):
-    # ... (Função format_currency permanece EXATAMENTE A MESMA)
-    try:
-        numeric_value = float(value)
-        return f"R$ {numeric_value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except (ValueError, TypeError):
-        return str(value)
+        df_local, anos_disponiveis_local, info_carga = load_tesouro_data(file_path, streaming, get_shared_cache())
+        if not anos_disponiveis_local: st.warning(f"Nenhum ano válido (>0) encontrado.")
+        return df_local, anos_disponiveis_local, info_carga
+    except FileNotFoundError: st.error(f"Erro: Arquivo '{file_path}' não encontrado."); return None, [], {}
+    except ValueError as e: st.error(f"Erro ao ler '{file_path}'. Verifique 'TESOURO_COLS'. Detalhe: {e}"); return None, [], {}
+    except Exception as e: st.error(f"Erro inesperado: {e}"); return None, [], {}
+
+@st.cache_data(ttl=DATA_DIR_REFRESH_TTL, show_spinner=False)
+def refresh_data_dir_cached(data_dir, merged_dir):
+    return refresh_data_dir(data_dir, merged_dir)
+
+@st.cache_data(ttl=DATA_DIR_REFRESH_TTL, show_spinner=False)
+def sync_dataset_cached(file_path, dataset_dir):
+    return sync_partitioned_dataset(file_path, dataset_dir)
+
+@st.cache_data(max_entries=DATA_VERSIONS_KEPT, show_spinner=False)
+def load_merged_dataset_cached(merged_dir, versao_dados):
+    return load_merged_dataset(merged_dir, versao_dados)
+
+# --- 3. Backends e Visões em Cache ---
+@st.cache_resource(max_entries=DATA_VERSIONS_KEPT, show_spinner=False)
+def get_cube_backend(versao_dados, _df):
+    # Cubo materializado uma vez por versão dos dados, compartilhado entre sessões
+    return CubeBackend(_df)
+
+@st.cache_resource(max_entries=DATA_VERSIONS_KEPT, show_spinner=False)
+def get_dataset_backend(dataset_dir, versao_dados):
+    return ParquetDatasetBackend(dataset_dir)
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def backend_options(versao_dados, dim, anos, _backend):
+    # Opções de um filtro por versão dos dados e anos selecionados (no modo dataset, cada consulta
+    # seria uma varredura do dataset a cada rerun)
+    return _backend.options(dim, None if anos is None else {'Ano_Orcamento': list(anos)})
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def cube_view(versao_dados, filtro_hash, view, _backend, _selecao):
+    # Resultado compartilhado entre sessões, chaveado por (versão dos dados, hash da seleção, visão);
+    # na falta, consulta o cache compartilhado entre réplicas antes de calcular
+    return shared_view(get_shared_cache(), versao_dados, filtro_hash, view, _backend, _selecao)
+
+@st.cache_resource(show_spinner=False)
+def start_prewarm(versao_dados, _backend):
+    # Uma vez por processo e versão dos dados, em segundo plano: publica as visões das seleções
+    # mais comuns no cache compartilhado (as que outra réplica já publicou são puladas)
+    cache = get_shared_cache()
+    if cache is None or not PREWARM_SELECTIONS: return None
+    def aquecer():
+        try: prewarm_shared_cache(cache, versao_dados, _backend, PREWARM_SELECTIONS)
+        except Exception as e: print(f"Aviso: falha ao pré-aquecer o cache compartilhado: {e}")
+    thread = threading.Thread(target=aquecer, name='coof-prewarm', daemon=True)
+    thread.start()
+    return thread
 
 # --- 4. Carregar os Dados Iniciais ---
-file_path_tesouro = 'Extrator BI Tesouro.xlsx'
-with st.spinner(f"Carregando '{file_path_tesouro}'..."):
-    df, anos_disponiveis = load_and_process_tesouro_data(file_path_tesouro)
+with stage('carregamento') as etapa_carga:
+    file_path_tesouro = 'Extrator BI Tesouro.xlsx'
+    relatorio_incremental = None
+    if DATA_DIR:
+        # Modo diretório: o dataset mesclado vai para COOF_DATASET_DIR (fora da memória) ou para o cache local
+        merged_dir = DATASET_DIR or os.path.join(INCREMENTAL_STORE_DIR, 'mesclado')
+        with st.spinner(f"Verificando extratos em '{DATA_DIR}'..."):
+            try: relatorio_incremental = refresh_data_dir_cached(DATA_DIR, merged_dir)
+            except Exception as e: st.error(f"Erro ao atualizar os extratos de '{DATA_DIR}': {e}"); stop_script()
+    if DATASET_DIR:
+        # Modo fora da memória: consultas direto no dataset particionado (criado a partir da planilha se
+        # vazio e recriado quando ela muda)
+        with st.spinner(f"Abrindo dataset '{DATASET_DIR}'..."):
+            try:
+                if not DATA_DIR: sync_dataset_cached(file_path_tesouro, DATASET_DIR)
+                versao_dados = dataset_version(DATASET_DIR)
+                query_backend = get_dataset_backend(DATASET_DIR, versao_dados)
+            except Exception as e: st.error(f"Erro ao abrir o dataset '{DATASET_DIR}': {e}"); stop_script()
+        anos_disponiveis = [ano for ano in backend_options(versao_dados, 'Ano_Orcamento', None, query_backend) if ano != 0]
+        info_carga = {'modo': 'dataset'}
+    elif DATA_DIR:
+        with st.spinner("Carregando extratos mesclados..."):
+            df, anos_disponiveis, info_carga = load_merged_dataset_cached(merged_dir, dataset_version(merged_dir))
+    else:
+        with st.spinner(f"Carregando '{file_path_tesouro}'..."):
+            df, anos_disponiveis, info_carga = load_and_process_tesouro_data(file_path_tesouro)
+    etapa_carga.set(modo=info_carga.get('modo'), linhas=None if DATASET_DIR or df is None else len(df))
 
 # --- 5. Verifica se os dados foram carregados ---
-if df is None: st.error("Falha no carregamento dos dados."); st.stop()
-elif df.empty: st.warning("Arquivo lido, mas vazio."); st.stop()
-else: st.success(f"Dados carregados ({len(df)} linhas).")
+if DATASET_DIR:
+    total_linhas = query_backend.count_rows()
+    if not total_linhas: st.warning("Dataset vazio."); stop_script()
+    st.success(f"Dataset particionado '{DATASET_DIR}' ({total_linhas} linhas, consultado sob demanda).")
+elif df is None: st.error("Falha no carregamento dos dados."); stop_script()
+elif df.empty: st.warning("Arquivo lido, mas vazio."); stop_script()
+else:
+    st.success(f"Dados carregados ({len(df)} linhas).")
+    versao_dados = info_carga['versao_dados']
+    with stage('cubo'): query_backend = get_cube_backend(versao_dados, df)
+start_prewarm(versao_dados, query_backend)
+if relatorio_incremental is not None:
+    st.caption(f"Extratos: {len(relatorio_incremental['novos'])} novos, {len(relatorio_incremental['alterados'])} alterados, "
+               f"{len(relatorio_incremental['removidos'])} removidos, {relatorio_incremental['inalterados']} inalterados; "
+               f"anos recalculados: {', '.join(map(str, relatorio_incremental['anos_recalculados'])) or 'nenhum'}."
+               + (f" Com erro (mantida a versão anterior, se houver): {'; '.join(f'{n} ({e})' for n, e in relatorio_incremental['erros'].items())}."
+                  if relatorio_incremental['erros'] else ""))
+if info_carga.get('modo') == 'streaming':
+    st.caption(f"Ingestão em blocos: {info_carga['linhas_lidas']} linhas lidas, "
+               f"{info_carga['rejeitadas_ano'] + info_carga['rejeitadas_moeda']} rejeitadas "
+               f"(ano inválido: {info_carga['rejeitadas_ano']}, moeda inválida: {info_carga['rejeitadas_moeda']}); "
+               f"{info_carga.get('linhas_layout', 0)} linhas de título/cabeçalho/total ignoradas.")
 
 # --- 6. Título Principal ---
 st.title("Dashboard de Execução Orçamentária")
 
 # --- 7. Configurar a Barra Lateral e Filtros Dependentes ---
 with st.sidebar:
-    # ... (Código da sidebar com logo e filtros dependentes permanece EXATAMENTE O MESMO)
+    # Logo e filtros dependentes; as opções vêm do backend de consulta (índices do cubo ou dataset), não do DataFrame
     try: st.image("icmbio.png", width=150)
     except Exception: st.warning("Logo 'icmbio.png' não encontrada.")
     st.header("Filtros")
@@ -125,203 +240,172 @@ with st.sidebar:
         default_year = [2025] if 2025 in anos_disponiveis else anos_disponiveis
         selected_years = st.multiselect("Ano Orçamento:", options=anos_disponiveis, default=default_year)
     else: selected_years = []
-    if selected_years:
-        numeric_years = [int(y) for y in selected_years]
-        df_pre_filtered = df[df['Ano_Orcamento'].isin(numeric_years)].copy()
-    else: df_pre_filtered = df.copy()
-    def create_dependent_filter(df_options, col_name, label, default_val=[]):
-        if col_name in df_options.columns:
-            unique_options = sorted(df_options[col_name].dropna().unique())
+    # As opções dos demais filtros dependem apenas dos anos selecionados
+    year_selection = tuple(int(y) for y in selected_years)
+    def create_dependent_filter(col_name, label, default_val=[]):
+        if query_backend.has_dim(col_name):
+            unique_options = backend_options(versao_dados, col_name, year_selection, query_backend)
             if unique_options:
                 valid_default = [d for d in default_val if d in unique_options]
                 return st.multiselect(label, options=unique_options, default=valid_default)
             else: st.info(f"Nenhuma opção de {label} para seleção atual."); return []
         else: st.warning(f"Coluna '{col_name}' não encontrada para filtro."); return []
-    selected_fonte = create_dependent_filter(df_pre_filtered, 'Fonte_Codigo', "Fonte Codigo:")
-    selected_acoes = create_dependent_filter(df_pre_filtered, 'Acao_Codigo', "Acao Codigo:")
-    selected_pos = create_dependent_filter(df_pre_filtered, 'PO_Codigo', "PO Codigo:")
-    selected_rp = create_dependent_filter(df_pre_filtered, 'RP_Codigo', "RP Codigo:", default_val=["2"])
+    with stage('filtros_barra_lateral'):
+        selected_fonte = create_dependent_filter('Fonte_Codigo', "Fonte Codigo:")
+        selected_acoes = create_dependent_filter('Acao_Codigo', "Acao Codigo:")
+        selected_pos = create_dependent_filter('PO_Codigo', "PO Codigo:")
+        selected_rp = create_dependent_filter('RP_Codigo', "RP Codigo:", default_val=["2"])
+    if DIAGNOSTICS:
+        st.divider()
+        st.toggle("Diagnóstico de desempenho", key='diag_painel')
+        painel_diagnostico = st.container() # preenchido no fim do script, com todas as etapas medidas
 
 # --- 8. Aplicar Filtros ---
-# ... (Código para criar filtered_df permanece EXATAMENTE O MESMO)
-filtered_df = df.copy()
-if selected_years:
-    numeric_years = [int(y) for y in selected_years]
-    filtered_df = filtered_df[filtered_df['Ano_Orcamento'].isin(numeric_years)].copy()
-if selected_fonte and 'Fonte_Codigo' in filtered_df.columns:
-    filtered_df = filtered_df[filtered_df['Fonte_Codigo'].isin(selected_fonte)].copy()
-if selected_acoes and 'Acao_Codigo' in filtered_df.columns:
-    filtered_df = filtered_df[filtered_df['Acao_Codigo'].isin(selected_acoes)].copy()
-if selected_pos and 'PO_Codigo' in filtered_df.columns:
-    filtered_df = filtered_df[filtered_df['PO_Codigo'].isin(selected_pos)].copy()
-if selected_rp and 'RP_Codigo' in filtered_df.columns:
-    filtered_df = filtered_df[filtered_df['RP_Codigo'].isin(selected_rp)].copy()
+# A seleção é resolvida sobre o cubo; nenhuma visão percorre as linhas brutas
+filter_selection = {
+    'Ano_Orcamento': [int(y) for y in selected_years],
+    'Fonte_Codigo': selected_fonte,
+    'Acao_Codigo': selected_acoes,
+    'PO_Codigo': selected_pos,
+    'RP_Codigo': selected_rp,
+}
+filter_hash = selection_hash(filter_selection)
+def get_view(view):
+    return cube_view(versao_dados, filter_hash, view, query_backend, filter_selection)
 
 # --- 9. Verificar se o DataFrame Filtrado Está Vazio ---
-# ... (Código permanece EXATAMENTE O MESMO)
-if filtered_df.empty:
+with stage('totais') as etapa:
+    totais = get_view('totais')
+    etapa.set(linhas=int(totais['Qtd_Linhas']))
+if totais['Qtd_Linhas'] == 0:
     st.warning("Sem dados para os filtros selecionados.")
-    st.stop()
+    stop_script()
 
 # --- Layout Principal ---
 st.divider()
 # --- 10. Exibir Métricas Resumo ---
-# ... (Código das métricas permanece EXATAMENTE O MESMO)
 st.header("Resumo da Execução")
-total_dotacao = filtered_df['Dotacao_Lei_Creditos'].sum()
-total_empenhado = filtered_df['Valor_Empenhado'].sum()
-total_liquidado = filtered_df['Valor_Liquidado'].sum()
-total_pago = filtered_df['Valor_Pago'].sum()
-total_saldo_empenho = filtered_df['Saldo_Empenho'].sum()
-total_saldo_a_empenhar = filtered_df['Saldo_a_Empenhar'].sum()
-m_col1, m_col2, m_col3 = st.columns(3)
-with m_col1: st.metric("Dotação Total", format_currency(total_dotacao))
-with m_col2: st.metric("Total Empenhado", format_currency(total_empenhado))
-with m_col3: st.metric("Total Liquidado", format_currency(total_liquidado))
-m_col4, m_col5, m_col6 = st.columns(3)
-with m_col4: st.metric("Total Pago", format_currency(total_pago))
-with m_col5: st.metric("Saldo de Empenho", format_currency(total_saldo_empenho), delta=format_currency(total_saldo_empenho - total_empenhado) if total_empenhado else None, help="Empenhado - Liquidado")
-with m_col6: st.metric("Saldo a Empenhar", format_currency(total_saldo_a_empenhar), delta=format_currency(total_saldo_a_empenhar - total_dotacao) if total_dotacao else None, help="Dotação - Empenhado")
+with stage('metricas'):
+    total_dotacao = to_reais(totais['Dotacao_Lei_Creditos'])
+    total_empenhado = to_reais(totais['Valor_Empenhado'])
+    total_liquidado = to_reais(totais['Valor_Liquidado'])
+    total_pago = to_reais(totais['Valor_Pago'])
+    total_saldo_empenho = to_reais(totais['Saldo_Empenho'])
+    total_saldo_a_empenhar = to_reais(totais['Saldo_a_Empenhar'])
+    m_col1, m_col2, m_col3 = st.columns(3)
+    with m_col1: st.metric("Dotação Total", format_currency(total_dotacao))
+    with m_col2: st.metric("Total Empenhado", format_currency(total_empenhado))
+    with m_col3: st.metric("Total Liquidado", format_currency(total_liquidado))
+    m_col4, m_col5, m_col6 = st.columns(3)
+    with m_col4: st.metric("Total Pago", format_currency(total_pago))
+    with m_col5: st.metric("Saldo de Empenho", format_currency(total_saldo_empenho), delta=format_currency(total_saldo_empenho - total_empenhado) if total_empenhado else None, help="Empenhado - Liquidado")
+    with m_col6: st.metric("Saldo a Empenhar", format_currency(total_saldo_a_empenhar), delta=format_currency(total_saldo_a_empenhar - total_dotacao) if total_dotacao else None, help="Dotação - Empenhado")
 st.divider()
 
 # --- 11. Tabela Principal e Tabela Detalhada (com botão) ---
-# ... (Código das tabelas e do botão toggle permanece EXATAMENTE O MESMO)
+# Tabelas formatadas e figuras dependem apenas do estado dos filtros: são reaproveitadas entre reruns
+@st.cache_data(max_entries=256, show_spinner=False)
+def formatted_view(versao_dados, filtro_hash, view, _backend, _selecao):
+    return format_table(cube_view(versao_dados, filtro_hash, view, _backend, _selecao))
+
+def toggle_po_detail():
+    st.session_state.show_po_detail = not st.session_state.show_po_detail
+
+def reset_po_page():
+    st.session_state.po_pagina = 1
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def sorted_po_detail(versao_dados, filtro_hash, ordenar_por, crescente, _backend, _selecao):
+    # Detalhe ordenado uma vez por estado dos filtros e ordem; compartilhado sem cópia (somente leitura)
+    return sort_po_detail(cube_view(versao_dados, filtro_hash, 'po', _backend, _selecao), ordenar_por, crescente)
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def searched_po_detail(versao_dados, filtro_hash, ordenar_por, crescente, busca, _backend, _selecao):
+    return search_po_detail(sorted_po_detail(versao_dados, filtro_hash, ordenar_por, crescente, _backend, _selecao), busca)
+
+@st.fragment
+@diagnosed_fragment('detalhe_po')
+def render_po_detail(versao_dados, filtro_hash, selecao):
+    # Fragmento: o botão, a busca, a ordem e a paginação reexecutam apenas este bloco
+    button_label = "Ocultar detalhado por PO" if st.session_state.show_po_detail else "Ver detalhado por PO"
+    st.button(button_label, on_click=toggle_po_detail)
+    if st.session_state.show_po_detail:
+        st.header("Execução Detalhada por PO")
+        try:
+            with stage('tabela_po') as etapa:
+                c_busca, c_ordem, c_sentido, c_tamanho = st.columns([3, 2, 1, 1])
+                with c_busca: busca = st.text_input("Buscar (Ação, PO ou Fonte):", key='po_busca', on_change=reset_po_page)
+                with c_ordem: ordenar_por = st.selectbox("Ordenar por:", list(DETAIL_SORT_OPTIONS), key='po_ordem', on_change=reset_po_page)
+                with c_sentido: sentido = st.selectbox("Ordem:", ["Crescente", "Decrescente"], key='po_sentido', on_change=reset_po_page)
+                with c_tamanho: tamanho_pagina = st.selectbox("Linhas por página:", DETAIL_PAGE_SIZES, index=1, key='po_tamanho', on_change=reset_po_page)
+                total_detalhe = len(sorted_po_detail(versao_dados, filtro_hash, ordenar_por, sentido == "Crescente", query_backend, selecao))
+                detalhe = searched_po_detail(versao_dados, filtro_hash, ordenar_por, sentido == "Crescente", busca, query_backend, selecao)
+                etapa.set(linhas=len(detalhe), linhas_total=total_detalhe)
+                if detalhe.empty:
+                    if total_detalhe: st.info("Nenhuma linha do detalhamento corresponde à busca.")
+                    else: st.info("Nenhum dado encontrado para o detalhamento por PO com os filtros atuais.")
+                    return
+                n_paginas = detail_page_count(len(detalhe), tamanho_pagina)
+                # Filtros alterados podem reduzir o número de páginas: ajusta antes de criar o widget
+                if st.session_state.get('po_pagina', 1) > n_paginas: st.session_state.po_pagina = n_paginas
+                pagina_df, inicio = format_detail_page(detalhe, st.session_state.get('po_pagina', 1), tamanho_pagina)
+                st.dataframe(pagina_df, use_container_width=True, hide_index=True)
+                etapa.set(linhas_pagina=len(pagina_df))
+                c_pagina, c_info = st.columns([1, 4])
+                with c_pagina: st.number_input("Página:", min_value=1, max_value=n_paginas, step=1, key='po_pagina')
+                with c_info:
+                    filtradas = f" (de {total_detalhe} no total)" if len(detalhe) != total_detalhe else ""
+                    st.caption(f"Linhas {inicio + 1}–{inicio + len(pagina_df)} de {len(detalhe)}{filtradas}; página {st.session_state.po_pagina} de {n_paginas}.")
+        except Exception as e: st.error(f"Erro ao gerar tabela detalhada por PO: {e}")
+
 st.header("Execução por Ação")
-table_cols_group = ['Acao_Codigo', 'Acao_Nome']
-table_cols_values = ['Dotacao_Lei_Creditos', 'Valor_Empenhado', 'Valor_Liquidado', 'Valor_Pago', 'Saldo_Empenho', 'Saldo_a_Empenhar']
-required_table_cols = table_cols_group + table_cols_values
-if all(col in filtered_df.columns for col in required_table_cols):
-    table_df_grouped = filtered_df.groupby(table_cols_group, as_index=False)[table_cols_values].sum()
-    table_df_grouped = table_df_grouped.sort_values(by='Valor_Empenhado', ascending=False)
-    table_df_formatted = table_df_grouped.copy()
-    for col in table_cols_values: table_df_formatted[col] = table_df_grouped[col].apply(format_currency)
+with stage('tabela_acao') as etapa:
+    table_df_formatted = formatted_view(versao_dados, filter_hash, 'acao', query_backend, filter_selection)
     st.dataframe(table_df_formatted, use_container_width=True, hide_index=True)
-else: st.warning(f"Colunas ausentes para Tabela por Ação: {[c for c in required_table_cols if c not in filtered_df.columns]}")
+    etapa.set(linhas=len(table_df_formatted))
 st.divider()
-button_label = "Ocultar detalhado por PO" if st.session_state.show_po_detail else "Ver detalhado por PO"
-if st.button(button_label): st.session_state.show_po_detail = not st.session_state.show_po_detail
-if st.session_state.show_po_detail:
-    st.header("Execução Detalhada por PO")
-    detail_cols_group = ['Acao_Codigo', 'Acao_Nome', 'PO_Codigo', 'PO_Nome', 'Fonte_Codigo', 'PTRES']
-    required_detail_cols = detail_cols_group + table_cols_values
-    if all(col in filtered_df.columns for col in required_detail_cols):
-        try:
-            detail_df_grouped = filtered_df.groupby(detail_cols_group, as_index=False)[table_cols_values].sum()
-            sum_values = detail_df_grouped[table_cols_values].abs().sum(axis=1)
-            detail_df_grouped = detail_df_grouped[sum_values > 0.01]
-            if not detail_df_grouped.empty:
-                detail_df_grouped = detail_df_grouped.sort_values(by=['Acao_Codigo', 'PO_Codigo', 'Fonte_Codigo'], ascending=True)
-                detail_df_formatted = detail_df_grouped.copy()
-                for col in table_cols_values: detail_df_formatted[col] = detail_df_grouped[col].apply(format_currency)
-                st.dataframe(detail_df_formatted, use_container_width=True, hide_index=True)
-            else: st.info("Nenhum dado encontrado para o detalhamento por PO com os filtros atuais.")
-        except Exception as e: st.error(f"Erro ao gerar tabela detalhada por PO: {e}")
-    else: st.warning(f"Colunas ausentes para Tabela Detalhada por PO: {[c for c in required_detail_cols if c not in filtered_df.columns]}")
+render_po_detail(versao_dados, filter_hash, filter_selection)
 
 # --- 12. Exibir Gráficos ---
-# ... (Código dos gráficos permanece EXATAMENTE O MESMO)
+@st.cache_data(max_entries=256, show_spinner=False)
+def build_chart_figures(versao_dados, filtro_hash, _backend, _selecao):
+    bar_fig = pie_fig = None
+    bar_chart_col_year = 'Ano_Orcamento'; bar_chart_col_value = 'Dotacao_Lei_Creditos'
+    bar_data = cube_view(versao_dados, filtro_hash, 'barras', _backend, _selecao)
+    if not bar_data.empty:
+        bar_data = prepare_bar_data(bar_data)
+        bar_fig = px.bar(bar_data, x=bar_chart_col_year, y=bar_chart_col_value, title='Dotação por Ano', template='plotly_dark', text_auto='.2s')
+        bar_fig.update_layout(xaxis_title='Ano Orçamento', yaxis_title='Dotação (R$)', xaxis_type='category')
+        bar_fig.update_traces(textposition='outside', hovertemplate='%{x}<br>%{y:,.2f} R$')
+    pie_chart_col_group = 'Acao_Codigo'; pie_chart_col_value = 'Dotacao_Lei_Creditos'
+    pie_data = cube_view(versao_dados, filtro_hash, 'pizza', _backend, _selecao)
+    if not pie_data.empty:
+        pie_data = prepare_pie_data(pie_data)
+        pie_fig = px.pie(pie_data, names=pie_chart_col_group, values=pie_chart_col_value, title='Dotação por Ação (Código)', hole=0.3, template='plotly_dark')
+        pie_fig.update_traces(textposition='outside', textinfo='percent+label', hovertemplate='%{label}<br>%{value:,.2f} R$ (%{percent})')
+        pie_fig.update_layout(showlegend=False)
+    return bar_fig, pie_fig
+
 st.divider()
 st.header("Análise Gráfica")
-chart_col1, chart_col2 = st.columns(2)
-with chart_col1: # Gráfico de Barras
-    bar_chart_col_year = 'Ano_Orcamento'; bar_chart_col_value = 'Dotacao_Lei_Creditos'
-    if bar_chart_col_year in filtered_df.columns and bar_chart_col_value in filtered_df.columns:
-        bar_data = filtered_df.groupby(bar_chart_col_year)[bar_chart_col_value].sum().reset_index()
-        bar_data = bar_data[bar_data[bar_chart_col_value] > 0]
-        if not bar_data.empty:
-            bar_data[bar_chart_col_year] = bar_data[bar_chart_col_year].astype(str)
-            bar_fig = px.bar(bar_data, x=bar_chart_col_year, y=bar_chart_col_value, title='Dotação por Ano', template='plotly_dark', text_auto='.2s')
-            bar_fig.update_layout(xaxis_title='Ano Orçamento', yaxis_title='Dotação (R$)', xaxis_type='category')
-            bar_fig.update_traces(textposition='outside', hovertemplate='%{x}<br>%{y:,.2f} R$')
-            st.plotly_chart(bar_fig, use_container_width=True)
+with stage('graficos_montagem'): bar_fig, pie_fig = build_chart_figures(versao_dados, filter_hash, query_backend, filter_selection)
+with stage('graficos_exibicao'):
+    chart_col1, chart_col2 = st.columns(2)
+    with chart_col1: # Gráfico de Barras
+        if bar_fig is not None: st.plotly_chart(bar_fig, use_container_width=True)
         else: st.info("Sem dados de Dotação para gráfico de barras.")
-    else: st.warning("Colunas para gráfico de barras não encontradas.")
-with chart_col2: # Gráfico de Pizza
-    pie_chart_col_group = 'Acao_Codigo'; pie_chart_col_value = 'Dotacao_Lei_Creditos'
-    if pie_chart_col_group in filtered_df.columns and pie_chart_col_value in filtered_df.columns:
-        pie_data = filtered_df.groupby(pie_chart_col_group)[pie_chart_col_value].sum().reset_index()
-        pie_data = pie_data[pie_data[pie_chart_col_value] > 0]
-        if not pie_data.empty:
-            max_slices = 7
-            if len(pie_data) > max_slices:
-                pie_data = pie_data.sort_values(by=pie_chart_col_value, ascending=False)
-                pie_data_top = pie_data.head(max_slices - 1)
-                outros_sum = pie_data.iloc[max_slices-1:][pie_chart_col_value].sum()
-                if outros_sum > 0:
-                    outros_row = pd.DataFrame([{pie_chart_col_group: 'Outras Ações', pie_chart_col_value: outros_sum}])
-                    pie_data = pd.concat([pie_data_top, outros_row], ignore_index=True)
-                else: pie_data = pie_data_top
-            pie_fig = px.pie(pie_data, names=pie_chart_col_group, values=pie_chart_col_value, title='Dotação por Ação (Código)', hole=0.3, template='plotly_dark')
-            pie_fig.update_traces(textposition='outside', textinfo='percent+label', hovertemplate='%{label}<br>%{value:,.2f} R$ (%{percent})')
-            pie_fig.update_layout(showlegend=False)
-            st.plotly_chart(pie_fig, use_container_width=True)
+    with chart_col2: # Gráfico de Pizza
+        if pie_fig is not None: st.plotly_chart(pie_fig, use_container_width=True)
         else: st.info("Sem dados de Dotação para gráfico de pizza.")
-    else: st.warning("Colunas para gráfico de pizza não encontradas.")
 
 
 # --- 13. Seção do Chatbot Interativo (MODIFICADO - Sem PandasAI) ---
-st.divider()
-st.header("🤖 Converse com os Dados Filtrados (via Google Gemini)")
-
-# Verifica se a biblioteca do Google foi importada
-if GEMINI_INSTALLED:
-    # Exibe mensagens antigas do histórico
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.write(message["content"]) # st.write lida bem com markdown/texto
-
-    # Input do usuário
-    if prompt := st.chat_input("Faça uma pergunta sobre os dados exibidos..."):
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with st.chat_message("user"):
-            st.markdown(prompt)
-
-        # Chama a IA (Gemini API direto)
-        try:
-            # Busca a chave de API (necessário configurar em Segredos no Streamlit Cloud)
-            api_key = st.secrets["GOOGLE_API_KEY"]
-            genai.configure(api_key=api_key)
-
-            # Configura o modelo Gemini Pro
-            # Para segurança, desabilitamos categorias potencialmente problemáticas
-            generation_config = {
-              "temperature": 0.8, # Um pouco mais criativo, ajuste se necessário
-              "top_p": 1,
-              "top_k": 1,
-              "max_output_tokens": 2048,
-            }
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            ]
-            model = genai.GenerativeModel(
-                model_name="gemini-1.5-flash-latest", # Modelo gratuito geralmente disponível
-                generation_config=generation_config,
-                safety_settings=safety_settings
-            )
-
-            # Prepara o contexto de dados a partir do filtered_df
-            if not filtered_df.empty:
-                # Converte o DataFrame filtrado (ou uma amostra) para texto/markdown
-                # Cuidado com o tamanho! Limita a um número de caracteres razoável.
-                MAX_CONTEXT_CHARS = 3500 # Ajuste conforme testes e limites de token
-                try:
-                    # Tenta usar markdown que é mais legível para o LLM
-                    data_context = filtered_df.to_markdown(index=False)
-                except ImportError:
-                    # Fallback para string simples se tabulate não estiver instalado
-                    data_context = filtered_df.to_string(index=False)
-
-                if len(data_context) > MAX_CONTEXT_CHARS:
-                    # Trunca o contexto se for muito grande
-                    data_context = data_context[:MAX_CONTEXT_CHARS] + "\n... (dados truncados)"
-                    st.caption(f"Atenção: Apenas parte dos dados filtrados ({MAX_CONTEXT_CHARS} caracteres) foi enviada como contexto para a IA.")
-
-                # Constrói o prompt final para o Gemini
-                full_prompt = f"""Você é um assistente prestativo especialista em análise de dados orçamentários.
-Analise os seguintes dados, que representam um extrato de execução orçamentária já filtrado:
+# O contexto enviado à IA vem de build_llm_context (coof_core), a partir dos agregados do cubo.
+LLM_CACHE_SIZE = 256
+LLM_CACHE_TTL = 3600 # segundos
+LLM_BLOCKED_MESSAGE = "A resposta foi bloqueada devido às configurações de segurança. Tente reformular sua pergunta."
+LLM_PROMPT_TEMPLATE = """Você é um assistente prestativo especialista em análise de dados orçamentários.
+Analise os seguintes dados, que representam um resumo agregado de um extrato de execução orçamentária já filtrado:
 
 --- INÍCIO DOS DADOS ---
 {data_context}
@@ -333,46 +417,103 @@ Não invente informações. Seja conciso e direto.
 
 Pergunta do usuário: {prompt}
 """
-                # Mostra o spinner enquanto chama a API
-                with st.chat_message("assistant"):
-                    with st.spinner("Pensando com Gemini..."):
-                        response = model.generate_content(full_prompt)
-                        try:
-                             # A resposta principal geralmente está em response.text
-                             response_content = response.text
-                        except ValueError:
-                             # Às vezes a resposta pode ser bloqueada por segurança
-                             response_content = "A resposta foi bloqueada devido às configurações de segurança. Tente reformular sua pergunta."
-                             # Opcional: Logar a resposta completa para depuração se necessário
-                             # print(response.prompt_feedback)
-                        except Exception as e_resp:
-                             response_content = f"Erro ao extrair texto da resposta: {e_resp}"
-
-                        st.write(response_content) # Exibe a resposta
-
-            else: # Se filtered_df estiver vazio
-                response_content = "Não há dados selecionados pelos filtros para analisar."
-                with st.chat_message("assistant"):
-                    st.warning(response_content)
-
-            # Adiciona resposta ao histórico
-            st.session_state.messages.append({"role": "assistant", "content": response_content})
-
-        except KeyError:
-             response_content = "Erro: Chave de API do Google (GOOGLE_API_KEY) não configurada nos Segredos do Streamlit."
-             with st.chat_message("assistant"): st.error(response_content)
-             st.session_state.messages.append({"role": "assistant", "content": response_content})
-        except NameError as e:
-             response_content = f"Erro: A biblioteca 'google.generativeai' não foi encontrada. ({e})"
-             with st.chat_message("assistant"): st.error(response_content)
-             st.session_state.messages.append({"role": "assistant", "content": response_content})
-        except Exception as e:
-            response_content = f"Ocorreu um erro inesperado ao chamar a API Gemini: {e}"
-            with st.chat_message("assistant"): st.error(response_content)
-            st.session_state.messages.append({"role": "assistant", "content": response_content})
-else:
-     # Mensagem se google-generativeai não está instalado
-     st.warning("Funcionalidade de Chat desabilitada. Instale a biblioteca 'google-generativeai'.")
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_client(api_key):
+    return GeminiClient(api_key)
+
+def get_llm_client():
+    if LLM_STUB: return StubLLMClient(delay=0.02)
+    # Busca a chave de API (necessário configurar em Segredos no Streamlit Cloud)
+    return get_gemini_client(st.secrets["GOOGLE_API_KEY"])
+
+@st.cache_resource(show_spinner=False)
+def get_llm_response_cache():
+    # Respostas compartilhadas entre sessões, chaveadas por (versão dos dados, hash dos filtros, pergunta)
+    return cachetools.TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL), threading.Lock()
+
+@st.fragment
+@diagnosed_fragment('chat')
+def render_chat(versao_dados, filtro_hash, selecao):
+    # Fragmento: enviar uma mensagem reexecuta apenas o painel do chat
+    # Verifica se a biblioteca do Google foi importada
+    if GEMINI_INSTALLED or LLM_STUB:
+        # Exibe mensagens antigas do histórico
+        for message in st.session_state.messages:
+            with st.chat_message(message["role"]):
+                st.write(message["content"]) # st.write lida bem com markdown/texto
+
+        # Input do usuário
+        if prompt := st.chat_input("Faça uma pergunta sobre os dados exibidos..."):
+            st.session_state.messages.append({"role": "user", "content": prompt})
+            with st.chat_message("user"):
+                st.markdown(prompt)
+
+            # Chama a IA (Gemini API direto)
+            try:
+                totais_chat = cube_view(versao_dados, filtro_hash, 'totais', query_backend, selecao)
+                if totais_chat['Qtd_Linhas'] > 0:
+                    cache, cache_lock = get_llm_response_cache()
+                    chave = (versao_dados, filtro_hash, normalize_prompt(prompt))
+                    with cache_lock: response_content = cache.get(chave)
+                    with st.chat_message("assistant"):
+                        if response_content is None:
+                            with stage('llm_contexto') as etapa:
+                                data_context = build_llm_context(
+                                    totais_chat,
+                                    cube_view(versao_dados, filtro_hash, 'acao', query_backend, selecao),
+                                    cube_view(versao_dados, filtro_hash, 'po', query_backend, selecao),
+                                    selecao)
+                                etapa.set(caracteres=len(data_context))
+                            full_prompt = LLM_PROMPT_TEMPLATE.format(data_context=data_context, prompt=prompt)
+                            client = get_llm_client()
+                            try:
+                                # Exibe os trechos à medida que chegam
+                                with stage('llm_resposta') as etapa:
+                                    response_content = st.write_stream(stream_with_timeout(client, full_prompt))
+                                    etapa.set(caracteres=len(response_content))
+                                with cache_lock: cache[chave] = response_content
+                            except LLMBlockedError:
+                                response_content = LLM_BLOCKED_MESSAGE
+                                st.write(response_content)
+                        else: st.write(response_content) # Exibe a resposta em cache
+
+                else: # Se não houver linhas para os filtros
+                    response_content = "Não há dados selecionados pelos filtros para analisar."
+                    with st.chat_message("assistant"):
+                        st.warning(response_content)
+
+                # Adiciona resposta ao histórico
+                st.session_state.messages.append({"role": "assistant", "content": response_content})
+
+            except LLMTimeoutError as e:
+                 response_content = f"Erro: A API Gemini não respondeu a tempo ({e}). Tente novamente."
+                 with st.chat_message("assistant"): st.error(response_content)
+                 st.session_state.messages.append({"role": "assistant", "content": response_content})
+            except KeyError:
+                 response_content = "Erro: Chave de API do Google (GOOGLE_API_KEY) não configurada nos Segredos do Streamlit."
+                 with st.chat_message("assistant"): st.error(response_content)
+                 st.session_state.messages.append({"role": "assistant", "content": response_content})
+            except NameError as e:
+                 response_content = f"Erro: A biblioteca 'google.generativeai' não foi encontrada. ({e})"
+                 with st.chat_message("assistant"): st.error(response_content)
+                 st.session_state.messages.append({"role": "assistant", "content": response_content})
+            except Exception as e:
+                response_content = f"Ocorreu um erro inesperado ao chamar a API Gemini: {e}"
+                with st.chat_message("assistant"): st.error(response_content)
+                st.session_state.messages.append({"role": "assistant", "content": response_content})
+    else:
+         # Mensagem se google-generativeai não está instalado
+         st.warning("Funcionalidade de Chat desabilitada. Instale a biblioteca 'google-generativeai'.")
+
+render_chat(versao_dados, filter_hash, filter_selection)
 
 # --- Fim do Script ---
-st.caption("Dashboard gerado com Streamlit e Plotly.")
\ No newline at end of file
+st.caption("Dashboard gerado com Streamlit e Plotly.")
+
+# --- Painel de Diagnóstico ---
+if diag_run is not None:
+    finish_diagnostics(diag_run)
+    st.session_state.diag_ativa = None
+    if st.session_state.get('diag_painel'):
+        with painel_diagnostico: render_diagnostics_panel(st.session_state.diag_execucoes)
\ No newline at end of file
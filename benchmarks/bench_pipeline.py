@@ -0,0 +1,241 @@
+# =============================================================================
+# Benchmark do núcleo de dados (coof_core) com extratos sintéticos
+# Gera dados no formato do 'Extrator BI Tesouro' (cardinalidades semelhantes às reais)
+# e mede as etapas carregamento, cubo, filtros, agregação, formatação e preparo dos
+# gráficos, sem Streamlit. O resultado é gravado em JSON para comparação entre versões.
+#
+# Uso:
+#   python benchmarks/bench_pipeline.py                          # 10k, 1M e 10M linhas
+#   python benchmarks/bench_pipeline.py --sizes 10000 1000000 --repeat 5
+#   python benchmarks/bench_pipeline.py --baseline bench_results.json --tolerance 0.25
+# =============================================================================
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import coof_core as core
+
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+# Seleções medidas: a padrão do dashboard (ano 2025 + RP "2") e o extrato inteiro
+SELECTIONS = {
+    'padrao': {'Ano_Orcamento': [2025], 'RP_Codigo': ['2']},
+    'todos': {},
+}
+# Cardinalidades observadas no extrato real
+N_ANOS = 12
+N_ACOES = 25
+N_POS = 35
+N_FONTES = 44
+N_PTRES = 324
+N_PARES_ACAO_PO = 92
+RP_PESOS = {'0': 20, '1': 201, '2': 614, '6': 110, '8': 3, '9': 34}
+RP_NOMES = {'0': 'FINANCEIRO', '1': 'PRIMARIO OBRIGATORIO', '2': 'PRIMARIO DISCRICIONARIO',
+            '6': 'DESPESA DISCRICIONARIA DECORRENTE DE EMENDA INDIVIDUAL',
+            '8': 'DESP.DISC.DECORRENTE DE EMENDA SF,CD E COMISSAO MISTA CN',
+            '9': 'DESP.DISC.DECORRENTE DE EMENDA DIR.GERAL PLOA,EXC.ORDEM TEC'}
+GND_PESOS = {'1': 98, '3': 691, '4': 156, '5': 31, '9': 6}
+ZIPF_EXPOENTE = 1.1 # poucas ações/fontes concentram a maior parte das linhas
+
+def _zipf_pesos(n, rng):
+    pesos = 1.0 / np.arange(1, n + 1) ** ZIPF_EXPOENTE
+    rng.shuffle(pesos)
+    return pesos / pesos.sum()
+
+def _categorical(codigos_linha, rotulos):
+    # Categórico a partir dos índices por linha, com categorias ordenadas (como no loader)
+    rotulos = np.asarray(rotulos, dtype=object)
+    ordem = np.argsort(rotulos, kind='stable')
+    posicao = np.empty(len(rotulos), dtype=np.int32)
+    posicao[ordem] = np.arange(len(rotulos), dtype=np.int32)
+    return pd.Categorical.from_codes(posicao[codigos_linha], categories=rotulos[ordem])
+
+def generate_tesouro_frame(n_rows, seed=0):
+    # DataFrame sintético já no esquema tratado (SNAPSHOT_COLS, categóricos, valores em centavos)
+    rng = np.random.default_rng(seed)
+    acoes = [f"{2000 + k:04d}" for k in range(N_ACOES)]
+    pos = [f"{k:04d}" for k in range(N_POS)]
+    fontes = [f"{1000 + 7 * k:04d}" for k in range(N_FONTES)]
+    # Folhas da hierarquia Ação -> PO -> PTRES (cada PTRES pertence a um par Ação/PO)
+    pesos_acao = _zipf_pesos(N_ACOES, rng)
+    pares = {(k, int(rng.integers(N_POS))) for k in range(N_ACOES)} # toda ação tem ao menos um PO
+    while len(pares) < N_PARES_ACAO_PO: pares.add((int(rng.choice(N_ACOES, p=pesos_acao)), int(rng.integers(N_POS))))
+    pares = sorted(pares)
+    folha_par = np.concatenate([np.arange(len(pares)), rng.integers(len(pares), size=N_PTRES - len(pares))])
+    folha_acao = np.array([pares[p][0] for p in folha_par])
+    folha_po = np.array([pares[p][1] for p in folha_par])
+    folha = rng.choice(N_PTRES, size=n_rows, p=_zipf_pesos(N_PTRES, rng))
+    par_linha = folha_par[folha]
+    rps, gnds = list(RP_PESOS), list(GND_PESOS)
+    rp_linha = rng.choice(len(rps), size=n_rows, p=np.array(list(RP_PESOS.values())) / sum(RP_PESOS.values()))
+    df_local = pd.DataFrame({
+        'Ano_Orcamento': rng.integers(2025 - N_ANOS + 1, 2026, size=n_rows, dtype=np.int64),
+        'Acao_Codigo': _categorical(folha_acao[folha], acoes),
+        'Acao_Nome': _categorical(folha_acao[folha], [f"ACAO ORCAMENTARIA {c}" for c in acoes]),
+        'PO_Codigo': _categorical(folha_po[folha], pos),
+        'PO_Nome': _categorical(par_linha, [f"PLANO ORCAMENTARIO {acoes[a]}/{pos[p]}" for a, p in pares]),
+        'GND_Codigo': _categorical(rng.choice(len(gnds), size=n_rows, p=np.array(list(GND_PESOS.values())) / sum(GND_PESOS.values())), gnds),
+        'RP_Codigo': _categorical(rp_linha, rps),
+        'RP_Nome': _categorical(rp_linha, [RP_NOMES[r] for r in rps]),
+        'Fonte_Codigo': _categorical(rng.choice(N_FONTES, size=n_rows, p=_zipf_pesos(N_FONTES, rng)), fontes),
+        'PTRES': _categorical(folha, [f"{170000 + 31 * k:06d}" for k in range(N_PTRES)]),
+    })
+    # Valores log-normais (mediana ~R$ 500 mil) com ~20-35% de zeros, como no extrato real
+    dotacao = np.round(rng.lognormal(np.log(5e7), 2.0, size=n_rows)).astype(np.int64)
+    dotacao[rng.random(n_rows) < 0.20] = 0
+    empenhado = np.round(dotacao * rng.random(n_rows)).astype(np.int64)
+    empenhado[rng.random(n_rows) < 0.10] = 0
+    liquidado = np.round(empenhado * rng.random(n_rows)).astype(np.int64)
+    pago = np.round(liquidado * rng.uniform(0.8, 1.0, size=n_rows)).astype(np.int64)
+    df_local['Dotacao_Lei_Creditos'] = dotacao
+    df_local['Valor_Empenhado'] = empenhado
+    df_local['Valor_Liquidado'] = liquidado
+    df_local['Valor_Pago'] = pago
+    df_local['Saldo_Empenho'] = empenhado - liquidado
+    df_local['Saldo_a_Empenhar'] = dotacao - empenhado
+    return df_local[core.SNAPSHOT_COLS]
+
+def write_tesouro_xlsx(df_local, xlsx_path):
+    # Planilha no leiaute do extrator (cabeçalho na linha 1, valores em reais), para medir a ingestão
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(['Ano Lançamento', 'Ação Governo', None, 'Plano Orçamentário', None, 'Grupo Despesa',
+               'Resultado Primário Lei', None, 'Fonte SOF', 'PTRES', 'Lei + Créditos', 'Empenhado', 'Liquidado', 'Pago'])
+    colunas = [df_local[c].astype(str).tolist() if c not in core.CURRENCY_COLS else core.to_reais(df_local[c]).tolist()
+               for c in core.TESOURO_COLS]
+    for linha in zip(*colunas): ws.append(list(linha))
+    wb.save(xlsx_path)
+
+def _timed(func, repeat):
+    tempos = []
+    for _ in range(repeat):
+        inicio = time.perf_counter()
+        resultado = func()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, tempos
+
+def _registro(linhas, selecao, etapa, tempos, **extra):
+    return {'linhas': linhas, 'selecao': selecao, 'etapa': etapa, 'repeticoes': len(tempos),
+            'min_s': min(tempos), 'mediana_s': statistics.median(tempos), 'max_s': max(tempos), **extra}
+
+def bench_size(n_rows, repeat, workdir, xlsx_max_rows, seed):
+    resultados = []
+    inicio = time.perf_counter()
+    df_gerado = generate_tesouro_frame(n_rows, seed)
+    print(f"[{n_rows} linhas] dados gerados em {time.perf_counter() - inicio:.2f} s")
+
+    if n_rows <= xlsx_max_rows:
+        xlsx_path = os.path.join(workdir, f"extrato_{n_rows}.xlsx")
+        write_tesouro_xlsx(df_gerado, xlsx_path)
+        def ingerir():
+            dataset_dir = os.path.join(workdir, f"dataset_{n_rows}")
+            shutil.rmtree(dataset_dir, ignore_errors=True)
+            return core.build_partitioned_dataset(xlsx_path, dataset_dir)
+        _, tempos = _timed(ingerir, repeat)
+        resultados.append(_registro(n_rows, None, 'ingest_xlsx', tempos))
+
+    parquet_path = os.path.join(workdir, f"extrato_{n_rows}.parquet")
+    core.write_tesouro_parquet(df_gerado, {'modo': 'sintetico'}, parquet_path)
+    del df_gerado
+    (df_local, _), tempos = _timed(lambda: core.read_tesouro_parquet(parquet_path), repeat)
+    resultados.append(_registro(n_rows, None, 'load', tempos, bytes_parquet=os.path.getsize(parquet_path)))
+
+    backend, tempos = _timed(lambda: core.CubeBackend(df_local), repeat)
+    resultados.append(_registro(n_rows, None, 'cube_build', tempos, linhas_cubo=len(backend.engine.df)))
+
+    for nome_selecao, selecao in SELECTIONS.items():
+        def filtrar():
+            # Opções da barra lateral (dependentes do ano) + recorte da seleção no cubo
+            anos = {'Ano_Orcamento': selecao.get('Ano_Orcamento', [])}
+            for dim in core.FILTER_DIMS[1:]: backend.options(dim, anos)
+            return backend.engine.materialize(backend.engine.select(selecao))
+        recorte, tempos = _timed(filtrar, repeat)
+        resultados.append(_registro(n_rows, nome_selecao, 'filter', tempos, linhas_recorte=len(recorte)))
+
+        visoes, tempos = _timed(lambda: {v: backend.view(v, selecao) for v in core.CUBE_VIEWS}, repeat)
+        resultados.append(_registro(n_rows, nome_selecao, 'aggregate', tempos))
+
+        def formatar():
+            totais = [core.format_currency(core.to_reais(visoes['totais'][c])) for c in core.VALUE_COLS]
+            return totais, core.format_table(visoes['acao']), core.format_table(visoes['po'])
+        _, tempos = _timed(formatar, repeat)
+        resultados.append(_registro(n_rows, nome_selecao, 'format', tempos, linhas_po=len(visoes['po'])))
+
+        def paginar():
+            # Detalhe por PO como no dashboard: ordenação, busca e formatação só da página visível
+            detalhe = core.search_po_detail(core.sort_po_detail(visoes['po'], 'Empenhado', False), '1000')
+            return core.format_detail_page(detalhe, 1, core.DETAIL_PAGE_SIZES[1])
+        _, tempos = _timed(paginar, repeat)
+        resultados.append(_registro(n_rows, nome_selecao, 'detail_page', tempos))
+
+        _, tempos = _timed(lambda: (core.prepare_bar_data(visoes['barras']), core.prepare_pie_data(visoes['pizza'])), repeat)
+        resultados.append(_registro(n_rows, nome_selecao, 'chart_prep', tempos))
+
+    os.remove(parquet_path)
+    for r in resultados:
+        print(f"  {r['etapa']:<11} {r['selecao'] or '':<7} mediana {r['mediana_s'] * 1000:10.2f} ms  (min {r['min_s'] * 1000:.2f} ms)")
+    return resultados
+
+def _metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError: commit = None
+    return {'data_hora': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'commit': commit, 'python': platform.python_version(),
+            'plataforma': platform.platform(), 'cpus': os.cpu_count(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'pyarrow': __import__('pyarrow').__version__, 'repeticoes': args.repeat, 'semente': args.seed}
+
+def compare_with_baseline(resultados, baseline_path, tolerance, min_delta_s=0.005):
+    # Regressão = mediana acima de (1 + tolerância) x referência e pelo menos min_delta_s mais lenta
+    with open(baseline_path, encoding='utf-8') as f: referencia = json.load(f)['resultados']
+    chave = lambda r: (r['linhas'], r['selecao'], r['etapa'])
+    anteriores = {chave(r): r for r in referencia}
+    regressoes = []
+    for r in resultados:
+        anterior = anteriores.get(chave(r))
+        if anterior is None: continue
+        razao = r['mediana_s'] / anterior['mediana_s'] if anterior['mediana_s'] else float('inf')
+        if razao > 1 + tolerance and r['mediana_s'] - anterior['mediana_s'] > min_delta_s:
+            regressoes.append((chave(r), anterior['mediana_s'], r['mediana_s'], razao))
+    for (linhas, selecao, etapa), antes, agora, razao in regressoes:
+        print(f"REGRESSÃO {etapa} ({linhas} linhas, {selecao or '-'}): {antes * 1000:.2f} ms -> {agora * 1000:.2f} ms ({razao:.2f}x)")
+    return regressoes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do núcleo de dados do dashboard COOF.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="quantidades de linhas sintéticas")
+    parser.add_argument('--repeat', type=int, default=3, help="repetições por etapa (registra min/mediana/max)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--xlsx-max-rows', type=int, default=10_000, help="mede a ingestão do xlsx até este tamanho")
+    parser.add_argument('--output', default='bench_results.json', help="arquivo JSON de saída")
+    parser.add_argument('--baseline', help="JSON de uma execução anterior para detectar regressões")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="folga relativa antes de acusar regressão")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='coof-bench-')
+    try:
+        resultados = []
+        for n_rows in args.sizes:
+            resultados += bench_size(n_rows, args.repeat, workdir, args.xlsx_max_rows, args.seed)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'meta': _metadata(args), 'resultados': resultados}, f, ensure_ascii=False, indent=1)
+    print(f"Resultados gravados em '{args.output}'.")
+    if args.baseline and compare_with_baseline(resultados, args.baseline, args.tolerance): return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
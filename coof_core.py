@@ -0,0 +1,1237 @@
+# =============================================================================
+# Núcleo de dados do Dashboard de Execução Orçamentária (sem Streamlit)
+# Carregamento, filtros, agregação, formatação e preparo dos gráficos. Importado pelo
+# COOF.py (que adiciona cache e exibição) e pelos benchmarks em 'benchmarks/'.
+# =============================================================================
+
+# --- 0. Importar Bibliotecas Necessárias ---
+import pandas as pd
+import numpy as np
+import os
+import glob
+import threading
+import hashlib
+import json
+import itertools
+import time
+import logging
+import importlib
+import tracemalloc
+import collections
+import tempfile
+import shutil
+import openpyxl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+try:
+    import resource # indisponível no Windows
+except ImportError:
+    resource = None
+try:
+    import redis # opcional: só para COOF_SHARED_CACHE=redis://...
+    REDIS_INSTALLED = True
+except ImportError:
+    REDIS_INSTALLED = False
+
+# --- Instrumentação por Etapa ---
+# COOF_DIAGNOSTICS=1 mede cada etapa da execução (tempo, pico de memória, linhas). Sem uma execução
+# ativa na thread, stage() devolve um contexto nulo compartilhado (custo de uma consulta à thread-local).
+DIAGNOSTICS = os.environ.get('COOF_DIAGNOSTICS', '0') == '1'
+# tracemalloc fica ligado apenas enquanto houver execução diagnosticada (deixa o processo mais lento);
+# a medição é do processo inteiro, então sessões simultâneas aparecem somadas
+DIAGNOSTICS_MEMORY = os.environ.get('COOF_DIAGNOSTICS_MEMORY', '1') == '1'
+DIAGNOSTICS_LOG = os.environ.get('COOF_DIAGNOSTICS_LOG') # arquivo JSONL (uma execução por linha)
+DIAGNOSTICS_HOOK = os.environ.get('COOF_DIAGNOSTICS_HOOK') # 'modulo:funcao' registrado com add_stage_hook
+diagnostics_logger = logging.getLogger('coof.diagnostico')
+_stage_hooks = []
+_current_run = threading.local()
+_memory_lock = threading.Lock()
+_memory_users = 0
+
+def add_stage_hook(hook):
+    # hook(evento, registro) com evento 'inicio' ou 'fim' (no 'fim' o registro já traz as medidas);
+    # ponto de acoplamento para perfiladores externos (cProfile, pyinstrument, spans de tracing)
+    if hook not in _stage_hooks: _stage_hooks.append(hook)
+
+def remove_stage_hook(hook):
+    if hook in _stage_hooks: _stage_hooks.remove(hook)
+
+def _acquire_memory_tracing():
+    global _memory_users
+    with _memory_lock:
+        if _memory_users == 0 and not tracemalloc.is_tracing(): tracemalloc.start()
+        _memory_users += 1
+    return True
+
+def _release_memory_tracing():
+    global _memory_users
+    with _memory_lock:
+        _memory_users -= 1
+        if _memory_users == 0: tracemalloc.stop()
+
+def _rss_peak_mb():
+    if resource is None: return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / (1024 * 1024 if os.uname().sysname == 'Darwin' else 1024), 1) # bytes no macOS, KB no Linux
+
+class _NullStage:
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def set(self, **info): pass
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    def __init__(self, run, nome, info):
+        self.run = run
+        self.registro = {'etapa': nome, 'nivel': len(run.pilha), **info}
+
+    def set(self, **info):
+        # Informações extras da etapa (ex.: linhas=len(tabela))
+        self.registro.update(info)
+
+    def __enter__(self):
+        run = self.run
+        if run.trace_memory:
+            # O pico é zerado a cada etapa; o da etapa externa é recomposto com os picos das internas
+            atual, pico = tracemalloc.get_traced_memory()
+            if run.pilha: run.pilha[-1]._pico = max(run.pilha[-1]._pico, pico)
+            tracemalloc.reset_peak()
+            self._memoria_inicio = self._pico = atual
+        self._arrow_inicio = pa.total_allocated_bytes()
+        run.pilha.append(self)
+        for hook in _stage_hooks: hook('inicio', self.registro)
+        self._inicio = time.perf_counter()
+        self.registro['inicio_ms'] = round((self._inicio - run._inicio) * 1000, 3)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duracao = time.perf_counter() - self._inicio
+        run = self.run
+        run.pilha.pop()
+        registro = self.registro
+        registro['duracao_ms'] = round(duracao * 1000, 3)
+        if run.trace_memory:
+            atual, pico = tracemalloc.get_traced_memory()
+            pico = max(pico, self._pico)
+            registro['pico_memoria_kb'] = round((pico - self._memoria_inicio) / 1024, 1)
+            registro['memoria_retida_kb'] = round((atual - self._memoria_inicio) / 1024, 1)
+            if run.pilha: run.pilha[-1]._pico = max(run.pilha[-1]._pico, pico)
+            tracemalloc.reset_peak()
+        registro['arrow_retida_kb'] = round((pa.total_allocated_bytes() - self._arrow_inicio) / 1024, 1)
+        if exc_type is not None: registro['erro'] = exc_type.__name__
+        run.etapas.append(registro)
+        for hook in _stage_hooks: hook('fim', registro)
+        return False
+
+class DiagnosticsRun:
+    # Uma execução (rerun completo ou de fragmento): lista de etapas na ordem em que terminaram
+    def __init__(self, tipo, trace_memory=DIAGNOSTICS_MEMORY):
+        self.tipo = tipo
+        self.etapas = []
+        self.pilha = []
+        self.finalizada = False
+        self.trace_memory = trace_memory and _acquire_memory_tracing()
+        self.inicio = time.time()
+        self._inicio = time.perf_counter()
+
+    def stage(self, nome, **info):
+        return _Stage(self, nome, info)
+
+    def finish(self, interrompida=False):
+        if self.finalizada: return None
+        self.finalizada = True
+        if self.trace_memory: _release_memory_tracing()
+        resumo = {'tipo': self.tipo, 'inicio': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.inicio)),
+                  'duracao_ms': round((time.perf_counter() - self._inicio) * 1000, 3), 'interrompida': interrompida,
+                  'memoria_rastreada': self.trace_memory, 'rss_pico_mb': _rss_peak_mb(), 'etapas': self.etapas}
+        _emit_run(resumo)
+        return resumo
+
+def _emit_run(resumo):
+    linha = json.dumps(resumo, ensure_ascii=False, default=str)
+    if DIAGNOSTICS_LOG:
+        try:
+            with open(DIAGNOSTICS_LOG, 'a', encoding='utf-8') as f: f.write(linha + '\n')
+        except OSError as e: print(f"Aviso: não foi possível gravar o diagnóstico em '{DIAGNOSTICS_LOG}': {e}")
+    diagnostics_logger.info(linha)
+
+def begin_run(tipo, trace_memory=DIAGNOSTICS_MEMORY):
+    # Torna a execução a atual da thread: as chamadas a stage() passam a ser registradas nela
+    run = DiagnosticsRun(tipo, trace_memory)
+    _current_run.run = run
+    return run
+
+def end_run(run, interrompida=False):
+    if getattr(_current_run, 'run', None) is run: _current_run.run = None
+    return run.finish(interrompida)
+
+def current_run():
+    run = getattr(_current_run, 'run', None)
+    return run if run is not None and not run.finalizada else None
+
+def stage(nome, **info):
+    run = getattr(_current_run, 'run', None)
+    if run is None: return _NULL_STAGE
+    return run.stage(nome, **info)
+
+if DIAGNOSTICS and DIAGNOSTICS_HOOK:
+    try:
+        modulo, funcao = DIAGNOSTICS_HOOK.split(':')
+        add_stage_hook(getattr(importlib.import_module(modulo), funcao))
+    except (ValueError, ImportError, AttributeError) as e:
+        print(f"Aviso: hook de diagnóstico '{DIAGNOSTICS_HOOK}' inválido: {e}")
+
+
+# --- 1. Carregamento e Preparação dos Dados ---
+# Esquema esperado do extrato (posição das colunas na planilha)
+TESOURO_COLS = [
+    'Ano_Orcamento', 'Acao_Codigo', 'Acao_Nome', 'PO_Codigo', 'PO_Nome',
+    'GND_Codigo', 'RP_Codigo', 'RP_Nome', 'Fonte_Codigo', 'PTRES',
+    'Dotacao_Lei_Creditos', 'Valor_Empenhado', 'Valor_Liquidado', 'Valor_Pago'
+]
+TESOURO_STR_COLS = ['RP_Codigo', 'Fonte_Codigo', 'Acao_Codigo', 'PO_Codigo', 'GND_Codigo', 'PTRES']
+CURRENCY_COLS = ['Dotacao_Lei_Creditos', 'Valor_Empenhado', 'Valor_Liquidado', 'Valor_Pago']
+VALUE_COLS = CURRENCY_COLS + ['Saldo_Empenho', 'Saldo_a_Empenhar']
+# Códigos e nomes têm baixa cardinalidade: ficam como categóricos (um dicionário por coluna)
+TESOURO_CATEGORY_COLS = TESOURO_STR_COLS + ['Acao_Nome', 'PO_Nome', 'RP_Nome']
+# Valores monetários são armazenados em centavos (int64) para somas exatas
+CENTAVOS = 100
+# Incrementar sempre que a limpeza ou as colunas derivadas mudarem (invalida os snapshots)
+TESOURO_SCHEMA_VERSION = 4
+SNAPSHOT_COLS = TESOURO_COLS + ['Saldo_Empenho', 'Saldo_a_Empenhar']
+
+# Snapshot colunar (Parquet) do extrato já tratado, reaproveitado entre reinícios e réplicas
+SNAPSHOT_DIR = os.environ.get('COOF_SNAPSHOT_DIR', '.coof_cache')
+# Ingestão em blocos (openpyxl read-only) para extratos grandes; linhas inválidas são descartadas
+TESOURO_STREAMING = os.environ.get('COOF_STREAMING', '0') == '1'
+STREAMING_CHUNK_ROWS = int(os.environ.get('COOF_STREAMING_CHUNK_ROWS', '50000'))
+
+def _tesouro_snapshot_key(file_path, streaming=False):
+    # Chave = conteúdo da planilha + versão do esquema de tratamento
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''): h.update(bloco)
+    esquema = {'versao': TESOURO_SCHEMA_VERSION, 'colunas': TESOURO_COLS,
+               'str': TESOURO_STR_COLS, 'moeda': CURRENCY_COLS, 'streaming': streaming}
+    h.update(json.dumps(esquema, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()[:24]
+
+def _snapshot_path(file_path, key):
+    base = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(SNAPSHOT_DIR, f"{base}.{key}.parquet")
+
+def read_tesouro_parquet(parquet_path):
+    # Lê um Parquet no esquema tratado (snapshot) -> (df, info_carga).
+    # memory_map evita uma cópia extra do arquivo; openpyxl não é utilizado.
+    # Colunas de texto são lidas já codificadas em dicionário (viram categóricos no pandas).
+    tabela = pq.read_table(parquet_path, memory_map=True, read_dictionary=TESOURO_CATEGORY_COLS)
+    # Metadados do rodapé do arquivo: o relatório gravado pelo ParquetWriter em streaming não aparece
+    # nos metadados do esquema Arrow
+    metadata = pq.read_metadata(parquet_path, memory_map=True).metadata or {}
+    info_carga = json.loads(metadata.get(b'coof_ingestao', b'{}'))
+    return _compact_tesouro_frame(tabela.to_pandas(self_destruct=True, split_blocks=True)), info_carga
+
+def _prune_snapshots(file_path, snapshot_path):
+    # Remove snapshots antigos da mesma planilha
+    base = os.path.splitext(os.path.basename(file_path))[0]
+    for antigo in glob.glob(os.path.join(glob.escape(SNAPSHOT_DIR), f"{glob.escape(base)}.*.parquet")):
+        if os.path.abspath(antigo) != os.path.abspath(snapshot_path):
+            try: os.remove(antigo)
+            except OSError: pass
+
+def write_tesouro_parquet(df_local, info_carga, parquet_path):
+    # Grava o DataFrame tratado com o relatório de ingestão no rodapé do Parquet
+    os.makedirs(os.path.dirname(parquet_path) or '.', exist_ok=True)
+    tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+    tabela = pa.Table.from_pandas(df_local, preserve_index=False)
+    metadata = dict(tabela.schema.metadata or {})
+    metadata[b'coof_ingestao'] = json.dumps(info_carga).encode('utf-8')
+    pq.write_table(tabela.replace_schema_metadata(metadata), tmp_path)
+    os.replace(tmp_path, parquet_path) # escrita atômica (outras réplicas podem estar lendo)
+
+def _write_snapshot(df_local, info_carga, file_path, snapshot_path):
+    try:
+        write_tesouro_parquet(df_local, info_carga, snapshot_path)
+        _prune_snapshots(file_path, snapshot_path)
+    except OSError as e:
+        print(f"Aviso: não foi possível gravar o snapshot '{snapshot_path}': {e}")
+
+def _parse_currency(serie):
+    # Células numéricas são mantidas; apenas texto no formato pt-BR ("1.234,56") é convertido.
+    # Retorna (valores, máscara de textos não conversíveis).
+    if pd.api.types.is_numeric_dtype(serie) or pd.api.types.infer_dtype(serie, skipna=True) in ('floating', 'integer', 'mixed-integer-float', 'empty'):
+        return pd.to_numeric(serie, errors='coerce').astype(float), pd.Series(False, index=serie.index)
+    textos = serie.str.strip() # NaN para células que não são texto
+    eh_texto = textos.notna() & (textos != '')
+    valores = pd.to_numeric(serie.where(textos.isna()), errors='coerce')
+    convertidos = pd.to_numeric(textos[eh_texto].str.replace('.', '', regex=False).str.replace(',', '.', regex=False), errors='coerce')
+    valores[eh_texto] = convertidos
+    return valores.astype(float), eh_texto & valores.isna()
+
+def to_centavos(valores):
+    return np.round(valores * CENTAVOS).astype('int64')
+
+def to_reais(valores):
+    return valores / CENTAVOS
+
+def _compact_tesouro_frame(df_local):
+    # Garante categóricos com dicionário único e ordenado (ordenações e groupbys seguem a ordem textual)
+    for col in TESOURO_CATEGORY_COLS:
+        if not isinstance(df_local[col].dtype, pd.CategoricalDtype):
+            df_local[col] = df_local[col].astype('category')
+        categorias = df_local[col].cat.categories
+        if not categorias.is_monotonic_increasing:
+            df_local[col] = df_local[col].cat.reorder_categories(sorted(categorias))
+    return df_local
+
+def _finish_tesouro_frame(df_local):
+    # Derivações comuns às duas formas de leitura
+    for col in CURRENCY_COLS:
+        df_local[col] = to_centavos(df_local[col].fillna(0))
+    df_local['Saldo_Empenho'] = df_local['Valor_Empenhado'] - df_local['Valor_Liquidado']
+    df_local['Saldo_a_Empenhar'] = df_local['Dotacao_Lei_Creditos'] - df_local['Valor_Empenhado']
+    str_cols_to_clean = ['Acao_Nome', 'PO_Nome', 'RP_Nome']
+    for col in str_cols_to_clean:
+        if col in df_local.columns: df_local[col] = df_local[col].astype(str).str.strip()
+    return df_local
+
+def _parse_tesouro_excel(file_path):
+    dtype_map = {}
+    for col_name in TESOURO_STR_COLS:
+        if col_name in TESOURO_COLS:
+            dtype_map[TESOURO_COLS.index(col_name)] = str
+        else:
+            print(f"Aviso: Coluna '{col_name}' definida para string não encontrada.")
+    df_local = pd.read_excel(file_path, header=0, usecols=range(len(TESOURO_COLS)), dtype=dtype_map)
+    df_local.columns = TESOURO_COLS
+    for col in CURRENCY_COLS:
+        df_local[col], _ = _parse_currency(df_local[col])
+    year_col = 'Ano_Orcamento'
+    df_local[year_col] = pd.to_numeric(df_local[year_col], errors='coerce')
+    df_local[year_col] = df_local[year_col].fillna(0).astype(int)
+    info_carga = {'modo': 'completo', 'linhas_lidas': len(df_local)}
+    return _compact_tesouro_frame(_finish_tesouro_frame(df_local)), info_carga
+
+def _excel_cell_to_str(valor):
+    # Mesmo critério do read_excel: floats inteiros viram int antes de virar texto
+    if valor is None: return None
+    if isinstance(valor, float):
+        if np.isnan(valor): return None
+        if valor.is_integer(): valor = int(valor)
+    return str(valor)
+
+def _process_tesouro_chunk(registros):
+    # Converte e valida um bloco de linhas cruas; retorna (bloco válido, rejeitadas_ano, rejeitadas_moeda)
+    bloco = pd.DataFrame.from_records(registros, columns=TESOURO_COLS)
+    year_col = 'Ano_Orcamento'
+    anos = pd.to_numeric(bloco[year_col], errors='coerce')
+    ano_invalido = anos.isna() | (anos <= 0) | (anos != anos.round())
+    moeda_invalida = pd.Series(False, index=bloco.index)
+    for col in CURRENCY_COLS:
+        bloco[col], invalidos = _parse_currency(bloco[col].astype(object))
+        moeda_invalida |= invalidos
+    moeda_invalida &= ~ano_invalido # cada linha é contada uma única vez
+    validas = ~(ano_invalido | moeda_invalida)
+    bloco = bloco[validas].copy()
+    bloco[year_col] = anos[validas].astype('int64')
+    for col in TESOURO_STR_COLS:
+        bloco[col] = bloco[col].map(_excel_cell_to_str).astype(object)
+    return _finish_tesouro_frame(bloco), int(ano_invalido.sum()), int(moeda_invalida.sum())
+
+def _is_data_row(registro):
+    # Linha de dados = primeira célula com um ano válido
+    try: ano = float(registro[0])
+    except (TypeError, ValueError): return False
+    return ano > 0 and ano.is_integer()
+
+def _is_total_row(registro):
+    return isinstance(registro[0], str) and registro[0].strip().casefold() == 'total'
+
+def _stream_tesouro_excel(file_path, destino, chunk_rows=STREAMING_CHUNK_ROWS):
+    # Lê a planilha bloco a bloco e grava cada bloco validado diretamente em Parquet,
+    # de modo que apenas um bloco de linhas cruas fique em memória por vez.
+    schema = pa.schema(
+        [('Ano_Orcamento', pa.int64())]
+        + [(c, pa.string()) for c in TESOURO_COLS if c not in ['Ano_Orcamento'] + CURRENCY_COLS]
+        + [(c, pa.int64()) for c in VALUE_COLS]
+    )
+    schema = pa.schema([schema.field(c) for c in SNAPSHOT_COLS])
+    # linhas_layout: título e cabeçalho antes dos dados (linhas 1–6 no 'Extrator BI') e linhas 'Total';
+    # não são dados e não entram em linhas_lidas nem nas rejeitadas
+    info_carga = {'modo': 'streaming', 'linhas_lidas': 0, 'linhas_layout': 0, 'rejeitadas_ano': 0, 'rejeitadas_moeda': 0}
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        linhas = ws.iter_rows(min_row=1, max_col=len(TESOURO_COLS), values_only=True)
+        # Os dados começam na primeira linha com ano válido; o que vem antes é layout
+        for primeira in linhas:
+            if _is_data_row(primeira):
+                linhas = itertools.chain([primeira], linhas); break
+            info_carga['linhas_layout'] += 1
+        with pq.ParquetWriter(destino, schema) as writer:
+            while True:
+                registros = [tuple(r) + (None,) * (len(TESOURO_COLS) - len(r)) for r in itertools.islice(linhas, chunk_rows)]
+                if not registros: break
+                n_registros = len(registros)
+                registros = [r for r in registros if not _is_total_row(r)]
+                info_carga['linhas_layout'] += n_registros - len(registros)
+                bloco, rejeitadas_ano, rejeitadas_moeda = _process_tesouro_chunk(registros)
+                del registros
+                info_carga['linhas_lidas'] += len(bloco) + rejeitadas_ano + rejeitadas_moeda
+                info_carga['rejeitadas_ano'] += rejeitadas_ano
+                info_carga['rejeitadas_moeda'] += rejeitadas_moeda
+                writer.write_table(pa.Table.from_pandas(bloco[SNAPSHOT_COLS], schema=schema, preserve_index=False))
+            # Relatório de ingestão no rodapé (lido por read_tesouro_parquet), gravado antes de fechar
+            writer.add_key_value_metadata({'coof_ingestao': json.dumps(info_carga)})
+    finally:
+        wb.close()
+    return info_carga
+
+def _load_tesouro_streaming(file_path, snapshot_path):
+    # Grava no próprio snapshot; sem permissão de escrita, usa um arquivo temporário
+    try:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        destino, temporario = f"{snapshot_path}.{os.getpid()}.tmp", False
+        open(destino, 'wb').close()
+    except OSError:
+        fd, destino = tempfile.mkstemp(suffix='.parquet'); os.close(fd); temporario = True
+    try:
+        info_carga = _stream_tesouro_excel(file_path, destino)
+        if temporario: return read_tesouro_parquet(destino)[0], info_carga
+        os.replace(destino, snapshot_path)
+        _prune_snapshots(file_path, snapshot_path)
+        return read_tesouro_parquet(snapshot_path)
+    finally:
+        if os.path.exists(destino): os.remove(destino)
+
+
+def available_years(df_local):
+    year_col = 'Ano_Orcamento'
+    return sorted(df_local[year_col][df_local[year_col] != 0].unique())
+
+def load_tesouro_data(file_path, streaming=TESOURO_STREAMING, shared_cache=None):
+    # Usa o snapshot Parquet quando ele corresponde ao conteúdo atual da planilha (local ou, se houver,
+    # no cache compartilhado); caso contrário relê o xlsx (inteiro ou em blocos) e regrava o snapshot.
+    # Retorna (df, anos disponíveis, info_carga); erros de leitura são propagados.
+    df_local = None
+    snapshot_key = _tesouro_snapshot_key(file_path, streaming)
+    snapshot_path = _snapshot_path(file_path, snapshot_key)
+    publicar = shared_cache is not None
+    if publicar and not os.path.exists(snapshot_path):
+        with stage('snapshot_cache_compartilhado') as etapa:
+            dados = shared_cache.fetch(dataset_cache_key(snapshot_key))
+            etapa.set(encontrado=dados is not None)
+        if dados is not None:
+            publicar = False
+            try:
+                os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+                tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f: f.write(dados)
+                os.replace(tmp_path, snapshot_path)
+                _prune_snapshots(file_path, snapshot_path)
+            except OSError as e: print(f"Aviso: não foi possível gravar o snapshot '{snapshot_path}': {e}")
+    if os.path.exists(snapshot_path):
+        try:
+            with stage('leitura_snapshot'): df_local, info_carga = read_tesouro_parquet(snapshot_path)
+        except Exception as e: print(f"Aviso: snapshot '{snapshot_path}' inválido, recriando. Detalhe: {e}")
+    if df_local is None and streaming:
+        with stage('leitura_xlsx', modo='streaming'): df_local, info_carga = _load_tesouro_streaming(file_path, snapshot_path)
+    elif df_local is None:
+        with stage('leitura_xlsx', modo='completo'): df_local, info_carga = _parse_tesouro_excel(file_path)
+        with stage('gravacao_snapshot'): _write_snapshot(df_local, info_carga, file_path, snapshot_path)
+    if publicar and os.path.exists(snapshot_path) and not shared_cache.has(dataset_cache_key(snapshot_key)):
+        with open(snapshot_path, 'rb') as f: shared_cache.store(dataset_cache_key(snapshot_key), f.read())
+    info_carga['versao_dados'] = snapshot_key
+    if 'Ano_Orcamento' not in df_local.columns: raise ValueError("Coluna 'Ano_Orcamento' não encontrada.")
+    return df_local, available_years(df_local), info_carga
+
+
+# --- Motor de Filtros Indexado ---
+# Dimensões filtráveis na barra lateral
+FILTER_DIMS = ['Ano_Orcamento', 'Fonte_Codigo', 'Acao_Codigo', 'PO_Codigo', 'RP_Codigo']
+
+class FilterEngine:
+    # Índice invertido por dimensão (valor -> posições ordenadas das linhas), montado uma vez por
+    # versão dos dados. Uma seleção é resolvida intersectando os índices e só o resultado final
+    # é materializado.
+    def __init__(self, df_base, dims=FILTER_DIMS):
+        self.df = df_base
+        self._codes = {}
+        self._values = {}
+        self._lookup = {}
+        self._postings = {}
+        for dim in dims:
+            if dim not in df_base.columns: continue
+            serie = df_base[dim]
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                codes, valores = serie.cat.codes.to_numpy(), serie.cat.categories
+            else:
+                codes, valores = pd.factorize(serie, sort=True) # NaN -> -1
+            codes = codes.astype(np.int32, copy=False)
+            ordem = np.argsort(codes, kind='stable').astype(np.int64) # posições crescentes dentro de cada valor
+            contagens = np.bincount(codes[codes >= 0], minlength=len(valores))
+            limites = np.concatenate([[0], np.cumsum(contagens)]) + int((codes < 0).sum())
+            self._codes[dim] = codes
+            self._values[dim] = list(valores)
+            self._lookup[dim] = {v: k for k, v in enumerate(valores)}
+            self._postings[dim] = (ordem, limites)
+
+    def has_dim(self, dim):
+        return dim in self._codes
+
+    def _rows_for(self, dim, valores):
+        ordem, limites = self._postings[dim]
+        partes = []
+        for valor in dict.fromkeys(valores):
+            k = self._lookup[dim].get(valor)
+            if k is not None and limites[k + 1] > limites[k]: partes.append(ordem[limites[k]:limites[k + 1]])
+        if not partes: return np.empty(0, dtype=np.int64)
+        if len(partes) == 1: return partes[0]
+        return np.sort(np.concatenate(partes)) # valores distintos -> conjuntos disjuntos
+
+    def select(self, selecao):
+        # selecao: {dimensão: [valores]}; lista vazia = sem filtro. Retorna None para "todas as linhas".
+        conjuntos = [self._rows_for(dim, valores) for dim, valores in selecao.items() if valores and self.has_dim(dim)]
+        if not conjuntos: return None
+        conjuntos.sort(key=len)
+        linhas = conjuntos[0]
+        for outro in conjuntos[1:]:
+            if not len(linhas): break
+            linhas = np.intersect1d(linhas, outro, assume_unique=True)
+        return linhas
+
+    def materialize(self, linhas):
+        # Sem filtro ativo devolve o próprio DataFrame (sem cópia); não deve ser alterado
+        if linhas is None: return self.df
+        return self.df.take(linhas)
+
+    def options(self, dim, selecao=None):
+        # Valores distintos (ordenados, sem nulos) de 'dim' nas linhas da seleção
+        linhas = self.select(selecao or {})
+        codes = self._codes[dim]
+        if linhas is None: presentes = np.flatnonzero(np.bincount(codes[codes >= 0], minlength=len(self._values[dim])))
+        else:
+            presentes = np.unique(codes[linhas])
+            presentes = presentes[presentes >= 0]
+        return [self._values[dim][k] for k in presentes]
+
+# --- Cubo de Agregação ---
+# Grão do cubo: todas as dimensões usadas em filtros, tabelas e gráficos (nomes acompanham os códigos)
+CUBE_DIMS = ['Ano_Orcamento', 'Acao_Codigo', 'Acao_Nome', 'PO_Codigo', 'PO_Nome',
+             'Fonte_Codigo', 'PTRES', 'RP_Codigo', 'GND_Codigo']
+TABLE_GROUP_COLS = ['Acao_Codigo', 'Acao_Nome']
+DETAIL_GROUP_COLS = ['Acao_Codigo', 'Acao_Nome', 'PO_Codigo', 'PO_Nome', 'Fonte_Codigo', 'PTRES']
+PIE_MAX_SLICES = 7
+
+def build_rollup_cube(df_base):
+    # dropna=False mantém linhas com dimensões nulas (entram nos totais, como nas linhas originais)
+    cube = df_base.groupby(CUBE_DIMS, observed=True, dropna=False, sort=False)[VALUE_COLS].sum()
+    cube['Qtd_Linhas'] = df_base.groupby(CUBE_DIMS, observed=True, dropna=False, sort=False).size()
+    return cube.reset_index()
+
+def selection_hash(selecao):
+    canonica = {dim: sorted(str(v) for v in selecao.get(dim) or []) for dim in FILTER_DIMS}
+    return hashlib.sha1(json.dumps(canonica, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Visões: funções puras que agregam um recorte (do cubo ou de linhas brutas, mesmo esquema).
+# Valores continuam em centavos; a conversão para reais fica na exibição.
+def view_totals(base):
+    totais = base[VALUE_COLS].sum()
+    totais['Qtd_Linhas'] = base['Qtd_Linhas'].sum() if 'Qtd_Linhas' in base.columns else len(base)
+    return totais
+
+def view_acao_table(base):
+    tabela = base.groupby(TABLE_GROUP_COLS, as_index=False, observed=True)[VALUE_COLS].sum()
+    return tabela.sort_values(by='Valor_Empenhado', ascending=False)
+
+def view_po_detail(base):
+    detalhe = base.groupby(DETAIL_GROUP_COLS, as_index=False, observed=True)[VALUE_COLS].sum()
+    sum_values = detalhe[VALUE_COLS].abs().sum(axis=1)
+    detalhe = detalhe[sum_values > 1] # centavos (> R$ 0,01)
+    return detalhe.sort_values(by=['Acao_Codigo', 'PO_Codigo', 'Fonte_Codigo'], ascending=True)
+
+def view_bar_data(base):
+    bar_data = base.groupby('Ano_Orcamento')['Dotacao_Lei_Creditos'].sum().reset_index()
+    return bar_data[bar_data['Dotacao_Lei_Creditos'] > 0]
+
+def view_pie_data(base):
+    pie_data = base.groupby('Acao_Codigo', observed=True)['Dotacao_Lei_Creditos'].sum().reset_index()
+    pie_data['Acao_Codigo'] = pie_data['Acao_Codigo'].astype(str)
+    pie_data = pie_data[pie_data['Dotacao_Lei_Creditos'] > 0]
+    if len(pie_data) > PIE_MAX_SLICES:
+        pie_data = pie_data.sort_values(by='Dotacao_Lei_Creditos', ascending=False)
+        pie_data_top = pie_data.head(PIE_MAX_SLICES - 1)
+        outros_sum = pie_data.iloc[PIE_MAX_SLICES-1:]['Dotacao_Lei_Creditos'].sum()
+        if outros_sum > 0:
+            outros_row = pd.DataFrame([{'Acao_Codigo': 'Outras Ações', 'Dotacao_Lei_Creditos': outros_sum}])
+            pie_data = pd.concat([pie_data_top, outros_row], ignore_index=True)
+        else: pie_data = pie_data_top
+    return pie_data
+
+CUBE_VIEWS = {
+    'totais': view_totals,
+    'acao': view_acao_table,
+    'po': view_po_detail,
+    'barras': view_bar_data,
+    'pizza': view_pie_data,
+}
+
+# --- Contexto para o Chat (IA) ---
+# O contexto enviado à IA é montado a partir das visões (totais, ações e POs), não das linhas
+# brutas, e ajustado a um orçamento de caracteres (~4 caracteres por token).
+LLM_CONTEXT_CHARS = 3500 # Ajuste conforme testes e limites de token
+LLM_TOP_N = 15
+
+def normalize_prompt(prompt):
+    return ' '.join(prompt.casefold().split())
+
+def describe_selection(selecao):
+    rotulos = {'Ano_Orcamento': 'Ano Orçamento', 'Fonte_Codigo': 'Fonte', 'Acao_Codigo': 'Ação', 'PO_Codigo': 'PO', 'RP_Codigo': 'RP'}
+    partes = [f"{rotulos[dim]}: {', '.join(str(v) for v in selecao.get(dim) or []) or 'todos'}" for dim in FILTER_DIMS]
+    return '; '.join(partes)
+
+LLM_VALUE_LABELS = {'Dotacao_Lei_Creditos': 'Dotação', 'Valor_Empenhado': 'Empenhado', 'Valor_Liquidado': 'Liquidado',
+                    'Valor_Pago': 'Pago', 'Saldo_Empenho': 'Saldo de Empenho', 'Saldo_a_Empenhar': 'Saldo a Empenhar'}
+
+def _context_lines(tabela, id_cols, n):
+    cols = {col: LLM_VALUE_LABELS[col] for col in CURRENCY_COLS}
+    topo = tabela.head(n)
+    formatados = {col: format_currency_column(topo[col]).tolist() for col in cols}
+    linhas = []
+    for i in range(len(topo)):
+        ident = ' | '.join(str(topo[c].iloc[i]) for c in id_cols)
+        linhas.append(ident + ' | ' + ' | '.join(f"{rotulo} {formatados[col][i]}" for col, rotulo in cols.items()))
+    return linhas
+
+def build_llm_context(totais, acao_table, po_detail, selecao, max_chars=LLM_CONTEXT_CHARS, top_n=LLM_TOP_N):
+    # Seções em ordem de prioridade; o top-N das tabelas é reduzido até caber no orçamento
+    cabecalho = [f"Filtros ativos: {describe_selection(selecao)}",
+                 f"Registros no extrato filtrado: {int(totais['Qtd_Linhas'])}",
+                 "Totais: " + '; '.join(f"{rotulo} {format_currency(to_reais(totais[col]))}" for col, rotulo in LLM_VALUE_LABELS.items())]
+    acoes = acao_table # já ordenada por empenho
+    pos = po_detail.groupby(['Acao_Codigo', 'PO_Codigo', 'PO_Nome'], as_index=False, observed=True)[VALUE_COLS].sum()
+    pos = pos.sort_values(by='Valor_Empenhado', ascending=False)
+    n = top_n
+    while True:
+        partes = list(cabecalho)
+        partes.append(f"Execução por Ação ({min(n, len(acoes))} de {len(acoes)}, maiores empenhos; Código | Nome | valores):")
+        partes += _context_lines(acoes, TABLE_GROUP_COLS, n)
+        partes.append(f"Execução por PO ({min(n, len(pos))} de {len(pos)}, maiores empenhos; Ação | PO | Nome | valores):")
+        partes += _context_lines(pos, ['Acao_Codigo', 'PO_Codigo', 'PO_Nome'], n)
+        contexto = '\n'.join(partes)
+        if len(contexto) <= max_chars or n == 0: return contexto[:max_chars]
+        n = n // 2
+
+# --- Backends de Consulta ---
+# Os dois backends oferecem a mesma interface: has_dim(dim), options(dim, selecao) e view(nome, selecao).
+class CubeBackend:
+    # Padrão: cubo em memória (pandas), materializado uma vez por versão dos dados
+    def __init__(self, df_base):
+        with stage('cubo_agregacao', linhas=len(df_base)) as etapa:
+            cube = build_rollup_cube(df_base)
+            etapa.set(linhas_cubo=len(cube))
+        with stage('cubo_indice'): self.engine = FilterEngine(cube)
+
+    def has_dim(self, dim):
+        return self.engine.has_dim(dim)
+
+    def options(self, dim, selecao=None):
+        return self.engine.options(dim, selecao)
+
+    def view(self, view, selecao):
+        return CUBE_VIEWS[view](self.engine.materialize(self.engine.select(selecao)))
+
+# Dataset Parquet particionado por ano (Ano_Orcamento=AAAA/...) para históricos maiores que a memória.
+# Quando COOF_DATASET_DIR está definido os dados não são carregados no pandas.
+DATASET_DIR = os.environ.get('COOF_DATASET_DIR')
+DATASET_BATCH_ROWS = 256_000
+# Marcador com a planilha de origem de um dataset criado por sync_partitioned_dataset (o prefixo '_'
+# deixa o arquivo fora da leitura do dataset)
+DATASET_SOURCE_MARKER = '_coof_origem.json'
+_dataset_build_lock = threading.Lock()
+# Grão mínimo de cada visão: a agregação é feita no Arrow e a função da visão finaliza no pandas
+VIEW_GRAIN = {
+    'totais': [],
+    'acao': TABLE_GROUP_COLS,
+    'po': DETAIL_GROUP_COLS,
+    'barras': ['Ano_Orcamento'],
+    'pizza': ['Acao_Codigo'],
+}
+
+class ParquetDatasetBackend:
+    # Filtros viram predicados do scanner (com poda das partições de ano) e as agregações são
+    # feitas lote a lote; apenas o resultado agregado é convertido para pandas.
+    def __init__(self, dataset_dir):
+        self.dataset = ds.dataset(dataset_dir, format='parquet', partitioning='hive')
+
+    def has_dim(self, dim):
+        return dim in self.dataset.schema.names
+
+    def count_rows(self):
+        return self.dataset.count_rows()
+
+    def _filter_expression(self, selecao):
+        expressao = None
+        for dim, valores in (selecao or {}).items():
+            if not valores or not self.has_dim(dim): continue
+            condicao = pc.field(dim).isin(pa.array(list(valores)).cast(self.dataset.schema.field(dim).type))
+            expressao = condicao if expressao is None else expressao & condicao
+        return expressao
+
+    def _aggregate(self, selecao, keys, values):
+        agregacoes = [(c, 'sum') for c in values] + [([], 'count_all')]
+        combinar = [(f'{c}_sum', 'sum') for c in values] + [('count_all', 'sum')]
+        scanner = self.dataset.scanner(columns=keys + values, filter=self._filter_expression(selecao),
+                                       batch_size=DATASET_BATCH_ROWS)
+        parciais = []
+        for batch in scanner.to_batches():
+            if batch.num_rows == 0: continue
+            parciais.append(pa.Table.from_batches([batch]).group_by(keys).aggregate(agregacoes))
+            if len(parciais) >= 64: # mantém a memória limitada ao tamanho do resultado
+                parciais = [self._combine(parciais, keys, combinar)]
+        if not parciais:
+            vazio = pd.DataFrame({c: pd.Series(dtype=self.dataset.schema.field(c).type.to_pandas_dtype()) for c in keys + values})
+            vazio['Qtd_Linhas'] = pd.Series(dtype='int64')
+            return vazio
+        resultado = self._combine(parciais, keys, combinar)
+        resultado = resultado.rename_columns(keys + values + ['Qtd_Linhas'])
+        return resultado.to_pandas()
+
+    @staticmethod
+    def _combine(parciais, keys, combinar):
+        tabela = pa.concat_tables(parciais).group_by(keys).aggregate(combinar)
+        return tabela.rename_columns(keys + [nome for nome, _ in combinar])
+
+    def options(self, dim, selecao=None):
+        distintos = self._aggregate(selecao, [dim], [])[dim].dropna()
+        return sorted(distintos.tolist())
+
+    def view(self, view, selecao):
+        return CUBE_VIEWS[view](self._aggregate(selecao, VIEW_GRAIN[view], VALUE_COLS))
+
+def build_partitioned_dataset(file_path, dataset_dir):
+    # Converte a planilha (em blocos, sem carregá-la inteira) num dataset particionado por ano
+    fd, tmp_path = tempfile.mkstemp(suffix='.parquet'); os.close(fd)
+    try:
+        info_carga = _stream_tesouro_excel(file_path, tmp_path)
+        ds.write_dataset(ds.dataset(tmp_path, format='parquet'), dataset_dir, format='parquet',
+                         partitioning=['Ano_Orcamento'], partitioning_flavor='hive',
+                         existing_data_behavior='overwrite_or_ignore')
+    finally:
+        os.remove(tmp_path)
+    return info_carga
+
+def sync_partitioned_dataset(file_path, dataset_dir):
+    # Cria o dataset a partir da planilha quando ele está vazio e o recria quando a planilha de origem
+    # mudou (tamanho+mtime e, se diferentes, o hash do conteúdo). Um dataset com Parquet e sem o
+    # marcador foi montado por fora (ex.: histórico de vários anos) e nunca é sobrescrito.
+    # Retorna True quando o dataset foi (re)criado.
+    marcador = os.path.join(dataset_dir, DATASET_SOURCE_MARKER)
+    with _dataset_build_lock:
+        try:
+            with open(marcador, encoding='utf-8') as f: origem = json.load(f)
+        except (OSError, ValueError): origem = None
+        if origem is None and glob.glob(os.path.join(glob.escape(dataset_dir), '**', '*.parquet'), recursive=True):
+            return False
+        stat = os.stat(file_path)
+        if origem and (origem['size'], origem['mtime_ns']) == (stat.st_size, stat.st_mtime_ns): return False
+        chave = _tesouro_snapshot_key(file_path, streaming=True)
+        origem_atual = {'arquivo': os.path.basename(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'chave': chave}
+        recriar = origem is None or origem.get('chave') != chave
+        if recriar:
+            # Monta ao lado e troca as pastas, para não misturar partições antigas e novas
+            dataset_dir = os.path.normpath(dataset_dir)
+            novo_dir, antigo_dir = f"{dataset_dir}.{os.getpid()}.novo", f"{dataset_dir}.{os.getpid()}.antigo"
+            shutil.rmtree(novo_dir, ignore_errors=True)
+            try: build_partitioned_dataset(file_path, novo_dir)
+            except BaseException: shutil.rmtree(novo_dir, ignore_errors=True); raise
+            if os.path.isdir(dataset_dir): os.replace(dataset_dir, antigo_dir)
+            os.replace(novo_dir, dataset_dir)
+            shutil.rmtree(antigo_dir, ignore_errors=True)
+        with open(marcador, 'w', encoding='utf-8') as f: json.dump(origem_atual, f)
+        return recriar
+
+def dataset_version(dataset_dir):
+    # Versão barata do dataset: caminhos, tamanhos e datas de modificação dos arquivos Parquet
+    h = hashlib.sha256()
+    for caminho in sorted(glob.glob(os.path.join(glob.escape(dataset_dir), '**', '*.parquet'), recursive=True)):
+        stat = os.stat(caminho)
+        h.update(f"{os.path.relpath(caminho, dataset_dir)}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8'))
+    return h.hexdigest()[:24]
+
+# --- Cache Compartilhado de Resultados ---
+# Segundo nível de cache, comum a processos e réplicas (o primeiro é o cache do Streamlit em cada
+# processo). Guarda o snapshot Parquet do extrato e as visões agregadas (totais, tabelas, gráficos),
+# com chave = versão dos dados + hash dos filtros + visão. COOF_SHARED_CACHE escolhe o armazenamento:
+#   'disk' (pasta local ou de rede), 'shm' (memória compartilhada via /dev/shm), 'memory' (substituto
+#   local em processo, para desenvolvimento) ou 'redis://host:porta/db' (Redis ou compatível).
+SHARED_CACHE_URL = os.environ.get('COOF_SHARED_CACHE', '')
+SHARED_CACHE_MAX_BYTES = int(float(os.environ.get('COOF_SHARED_CACHE_MAX_MB', '512')) * 1024 * 1024)
+SHARED_CACHE_DIR = os.environ.get('COOF_SHARED_CACHE_DIR', os.path.join(SNAPSHOT_DIR, 'resultados'))
+SHARED_CACHE_SHM_DIR = '/dev/shm/coof-cache'
+SHARED_CACHE_TTL = int(os.environ.get('COOF_SHARED_CACHE_TTL', str(7 * 24 * 3600))) # segundos (Redis)
+SHARED_CACHE_TIMEOUT = 0.5 # segundos por operação no Redis
+SHARED_CACHE_RETRY_AFTER = 30 # segundos sem usar o cache depois de uma falha do armazenamento
+SHARED_CACHE_FORMAT = 1 # incrementar quando o formato ou a semântica das visões mudar
+# Seleções aquecidas na subida de cada processo (padrão: a seleção inicial do dashboard)
+PREWARM_SELECTIONS = json.loads(os.environ.get('COOF_PREWARM_SELECTIONS', '[{"Ano_Orcamento": [2025], "RP_Codigo": ["2"]}]'))
+
+def encode_frame(obj):
+    # DataFrame/Series -> bytes (Arrow IPC; categóricos e índice preservados, sem pickle)
+    serie = isinstance(obj, pd.Series)
+    tabela = pa.Table.from_pandas(obj.to_frame(name='valor') if serie else obj)
+    metadata = dict(tabela.schema.metadata or {})
+    metadata[b'coof_objeto'] = json.dumps({'serie': serie, 'nome': obj.name if serie else None}).encode('utf-8')
+    tabela = tabela.replace_schema_metadata(metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, tabela.schema) as writer: writer.write_table(tabela)
+    return sink.getvalue().to_pybytes()
+
+def decode_frame(dados):
+    tabela = pa.ipc.open_stream(dados).read_all()
+    objeto = json.loads((tabela.schema.metadata or {}).get(b'coof_objeto', b'{}'))
+    df_local = tabela.to_pandas()
+    return df_local['valor'].rename(objeto.get('nome')) if objeto.get('serie') else df_local
+
+def view_cache_key(versao_dados, filtro_hash, view):
+    return f"coof:{SHARED_CACHE_FORMAT}:visao:{versao_dados}:{filtro_hash}:{view}"
+
+def dataset_cache_key(versao_dados):
+    return f"coof:{SHARED_CACHE_FORMAT}:dataset:{versao_dados}"
+
+class SharedCache:
+    # Interface do armazenamento: get(chave) -> bytes ou None, set(chave, bytes), contains(chave).
+    # fetch/store envolvem essas operações: falhas do armazenamento viram ausência de cache (e o
+    # cache é ignorado por SHARED_CACHE_RETRY_AFTER segundos), nunca um erro no dashboard.
+    max_item_bytes = None
+
+    def get(self, chave):
+        raise NotImplementedError
+
+    def set(self, chave, valor):
+        raise NotImplementedError
+
+    def contains(self, chave):
+        return self.get(chave) is not None
+
+    def _available(self):
+        return time.monotonic() >= getattr(self, '_pausado_ate', 0)
+
+    def _failed(self, e):
+        self._pausado_ate = time.monotonic() + SHARED_CACHE_RETRY_AFTER
+        print(f"Aviso: cache compartilhado indisponível por {SHARED_CACHE_RETRY_AFTER} s: {e}")
+
+    def fetch(self, chave):
+        if not self._available(): return None
+        try: return self.get(chave)
+        except Exception as e: self._failed(e); return None
+
+    def store(self, chave, dados):
+        if not self._available() or (self.max_item_bytes and len(dados) > self.max_item_bytes): return False
+        try: self.set(chave, dados); return True
+        except Exception as e: self._failed(e); return False
+
+    def has(self, chave):
+        if not self._available(): return False
+        try: return self.contains(chave)
+        except Exception as e: self._failed(e); return False
+
+    def fetch_frame(self, chave):
+        dados = self.fetch(chave)
+        if dados is None: return None
+        try: return decode_frame(dados)
+        except Exception as e: print(f"Aviso: entrada '{chave}' inválida no cache compartilhado: {e}"); return None
+
+    def store_frame(self, chave, obj):
+        return self.store(chave, encode_frame(obj))
+
+class MemoryCache(SharedCache):
+    # Substituto local (um processo) com a mesma interface; LRU limitado em bytes
+    def __init__(self, max_bytes=SHARED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_bytes // 4
+        self._itens = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            valor = self._itens.get(chave)
+            if valor is not None: self._itens.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor):
+        with self._lock:
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None: self._bytes -= len(anterior)
+            self._itens[chave] = valor
+            self._bytes += len(valor)
+            while self._bytes > self.max_bytes and self._itens:
+                self._bytes -= len(self._itens.popitem(last=False)[1])
+
+    def contains(self, chave):
+        with self._lock: return chave in self._itens
+
+class DiskCache(SharedCache):
+    # Um arquivo por entrada numa pasta comum aos processos (disco local, rede ou /dev/shm).
+    # Escrita atômica; a leitura renova a data de modificação, e a remoção apaga os arquivos
+    # mais antigos quando o total passa de max_bytes (LRU aproximado entre processos).
+    def __init__(self, cache_dir, max_bytes=SHARED_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_bytes // 4
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._bytes = self._evict()
+
+    def _path(self, chave):
+        return os.path.join(self.cache_dir, hashlib.sha256(chave.encode('utf-8')).hexdigest()[:40] + '.bin')
+
+    def get(self, chave):
+        caminho = self._path(chave)
+        try:
+            with open(caminho, 'rb') as f: dados = f.read()
+        except FileNotFoundError: return None
+        try: os.utime(caminho)
+        except OSError: pass
+        return dados
+
+    def set(self, chave, valor):
+        caminho = self._path(chave)
+        tmp_path = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f: f.write(valor)
+        os.replace(tmp_path, caminho)
+        with self._lock:
+            self._bytes += len(valor)
+            # O total é estimado pelo próprio processo; ao passar do limite a pasta é reavaliada
+            if self._bytes > self.max_bytes: self._bytes = self._evict()
+
+    def contains(self, chave):
+        return os.path.exists(self._path(chave))
+
+    def _evict(self):
+        entradas = []
+        for caminho in glob.glob(os.path.join(glob.escape(self.cache_dir), '*.bin')):
+            try: stat = os.stat(caminho)
+            except OSError: continue
+            entradas.append((stat.st_mtime_ns, stat.st_size, caminho))
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, caminho in sorted(entradas):
+            if total <= self.max_bytes * 0.9: break # folga para não reavaliar a cada escrita
+            try: os.remove(caminho); total -= tamanho
+            except OSError: pass
+        return total
+
+class RedisCache(SharedCache):
+    # Redis ou compatível (Valkey, KeyDB...). O limite de memória e a remoção ficam com o servidor
+    # (maxmemory + maxmemory-policy allkeys-lru); cada entrada também expira após ttl segundos.
+    # 'client' permite injetar outro cliente com a mesma API (get/set/exists).
+    def __init__(self, url=None, ttl=SHARED_CACHE_TTL, max_item_bytes=SHARED_CACHE_MAX_BYTES // 4, client=None):
+        self.client = client if client is not None else redis.Redis.from_url(
+            url, socket_timeout=SHARED_CACHE_TIMEOUT, socket_connect_timeout=SHARED_CACHE_TIMEOUT)
+        self.ttl = ttl
+        self.max_item_bytes = max_item_bytes
+
+    def get(self, chave):
+        return self.client.get(chave)
+
+    def set(self, chave, valor):
+        self.client.set(chave, valor, ex=self.ttl)
+
+    def contains(self, chave):
+        return bool(self.client.exists(chave))
+
+def open_shared_cache(url=SHARED_CACHE_URL):
+    # Cria o cache configurado; None quando desativado ou indisponível
+    if not url: return None
+    try:
+        if url == 'memory': return MemoryCache()
+        if url == 'disk': return DiskCache(SHARED_CACHE_DIR)
+        if url == 'shm': return DiskCache(SHARED_CACHE_SHM_DIR)
+        if url.startswith(('redis://', 'rediss://', 'unix://')):
+            if not REDIS_INSTALLED: print("Aviso: COOF_SHARED_CACHE usa Redis, mas a biblioteca 'redis' não está instalada."); return None
+            return RedisCache(url)
+    except OSError as e:
+        print(f"Aviso: não foi possível abrir o cache compartilhado '{url}': {e}"); return None
+    print(f"Aviso: COOF_SHARED_CACHE '{url}' não reconhecido (use disk, shm, memory ou redis://...).")
+    return None
+
+def shared_view(cache, versao_dados, filtro_hash, view, backend, selecao):
+    # Visão do cache compartilhado quando disponível; senão calcula e publica para os demais processos
+    with stage('visao', visao=view) as etapa:
+        chave = view_cache_key(versao_dados, filtro_hash, view)
+        resultado = cache.fetch_frame(chave) if cache is not None else None
+        if resultado is not None: etapa.set(origem='cache_compartilhado'); return resultado
+        resultado = backend.view(view, selecao)
+        if cache is not None: cache.store_frame(chave, resultado)
+        etapa.set(origem='calculada')
+        return resultado
+
+def prewarm_shared_cache(cache, versao_dados, backend, selecoes=PREWARM_SELECTIONS):
+    # Calcula e publica as visões das seleções mais comuns (as já presentes são puladas)
+    publicadas = 0
+    for selecao in selecoes:
+        filtro_hash = selection_hash(selecao)
+        for view in CUBE_VIEWS:
+            if cache.has(view_cache_key(versao_dados, filtro_hash, view)): continue
+            publicadas += cache.store_frame(view_cache_key(versao_dados, filtro_hash, view), backend.view(view, selecao))
+    return publicadas
+
+# --- Ingestão Incremental de Vários Extratos ---
+# Modo diretório (COOF_DATA_DIR): cada extrato é processado uma única vez para uma partição própria;
+# arquivos novos/alterados são detectados por tamanho+mtime (e confirmados por hash) e apenas os anos
+# afetados do dataset mesclado (Ano_Orcamento=AAAA/) são recalculados.
+DATA_DIR = os.environ.get('COOF_DATA_DIR')
+DATA_DIR_PATTERN = '*.xlsx'
+INCREMENTAL_STORE_DIR = os.path.join(SNAPSHOT_DIR, 'incremental')
+# Chave de mesclagem: quando a mesma chave aparece em mais de um extrato, vencem as linhas do extrato
+# cujo conteúdo foi alterado mais recentemente (mtime na ingestão; empate pelo nome do arquivo)
+MERGE_KEY = ['Ano_Orcamento', 'Acao_Codigo', 'PO_Codigo', 'Fonte_Codigo', 'PTRES', 'RP_Codigo', 'GND_Codigo']
+_incremental_lock = threading.Lock()
+
+def _file_sha256(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''): h.update(bloco)
+    return h.hexdigest()
+
+def _load_manifest(store_dir):
+    try:
+        with open(os.path.join(store_dir, 'manifest.json'), encoding='utf-8') as f: manifest = json.load(f)
+    except (OSError, ValueError): manifest = {}
+    if manifest.get('versao_esquema') != TESOURO_SCHEMA_VERSION: # partições processadas com outro esquema
+        manifest = {'versao_esquema': TESOURO_SCHEMA_VERSION, 'arquivos': {}}
+    return manifest
+
+def _save_manifest(store_dir, manifest):
+    tmp_path = os.path.join(store_dir, f".manifest.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, os.path.join(store_dir, 'manifest.json'))
+
+def _ingest_extract(file_path, nome, sha, stat, store_dir):
+    particao = os.path.join('arquivos', f"{sha[:32]}.parquet")
+    destino = os.path.join(store_dir, particao)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    tmp_path = f"{destino}.{os.getpid()}.tmp"
+    try:
+        info_carga = _stream_tesouro_excel(file_path, tmp_path)
+        os.replace(tmp_path, destino)
+    except BaseException:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+    anos = pq.read_table(destino, columns=['Ano_Orcamento']).column(0).unique().to_pylist()
+    return {'nome': nome, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha,
+            'particao': particao, 'anos': sorted(anos), 'ordem': stat.st_mtime_ns,
+            'linhas': info_carga['linhas_lidas'] - info_carga['rejeitadas_ano'] - info_carga['rejeitadas_moeda'],
+            'rejeitadas': info_carga['rejeitadas_ano'] + info_carga['rejeitadas_moeda']}
+
+def _rebuild_year(ano, arquivos, store_dir, merged_dir):
+    destino_dir = os.path.join(merged_dir, f"Ano_Orcamento={ano}")
+    fontes = sorted((e for e in arquivos.values() if ano in e['anos']), key=lambda e: (e['ordem'], e['nome']))
+    if not fontes:
+        shutil.rmtree(destino_dir, ignore_errors=True); return
+    partes = []
+    for prioridade, entrada in enumerate(fontes):
+        tabela = pq.read_table(os.path.join(store_dir, entrada['particao']), filters=[('Ano_Orcamento', '=', ano)])
+        partes.append(tabela.append_column('_prioridade', pa.array(np.full(tabela.num_rows, prioridade, dtype='int32'))))
+    tabela = pa.concat_tables(partes)
+    if len(fontes) > 1:
+        # Para cada chave ficam apenas as linhas do extrato de maior prioridade que a contém
+        ano_df = tabela.to_pandas()
+        vencedor = ano_df.groupby(MERGE_KEY, dropna=False, sort=False)['_prioridade'].transform('max')
+        tabela = pa.Table.from_pandas(ano_df[ano_df['_prioridade'] == vencedor], preserve_index=False)
+    tabela = tabela.drop_columns(['_prioridade', 'Ano_Orcamento']) # o ano fica no caminho (hive)
+    os.makedirs(destino_dir, exist_ok=True)
+    tmp_path = os.path.join(destino_dir, f".part-0.{os.getpid()}.tmp") # ignorado pelo leitor do dataset
+    pq.write_table(tabela, tmp_path)
+    os.replace(tmp_path, os.path.join(destino_dir, 'part-0.parquet'))
+
+def refresh_data_dir(data_dir, merged_dir, store_dir=INCREMENTAL_STORE_DIR):
+    # Sincroniza o dataset mesclado com o diretório de extratos; o custo é proporcional ao que mudou
+    with _incremental_lock:
+        os.makedirs(store_dir, exist_ok=True)
+        os.makedirs(merged_dir, exist_ok=True)
+        manifest = _load_manifest(store_dir)
+        arquivos = manifest['arquivos']
+        relatorio = {'novos': [], 'alterados': [], 'removidos': [], 'inalterados': 0, 'anos_recalculados': [], 'erros': {}}
+        anos_afetados = set()
+        presentes = set()
+        for caminho in sorted(glob.glob(os.path.join(glob.escape(data_dir), '**', DATA_DIR_PATTERN), recursive=True)):
+            nome = os.path.relpath(caminho, data_dir)
+            if os.path.basename(nome).startswith('~$'): continue # arquivo de bloqueio do Excel
+            presentes.add(nome)
+            anterior = arquivos.get(nome)
+            try:
+                stat = os.stat(caminho)
+                if anterior and (anterior['size'], anterior['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+                    relatorio['inalterados'] += 1; continue
+                sha = _file_sha256(caminho)
+                if anterior and anterior['sha256'] == sha: # só a data mudou: mantém a prioridade original
+                    anterior.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                    relatorio['inalterados'] += 1; continue
+                entrada = _ingest_extract(caminho, nome, sha, stat, store_dir)
+            except Exception as e:
+                # Arquivo corrompido ou ainda sendo copiado: mantém a versão anterior (se houver) e
+                # tenta de novo no próximo refresh, sem impedir os demais extratos
+                relatorio['erros'][nome] = f"{type(e).__name__}: {e}"
+                print(f"Aviso: extrato '{nome}' ignorado nesta atualização: {e}")
+                continue
+            if anterior:
+                anos_afetados.update(anterior['anos']); relatorio['alterados'].append(nome)
+            else: relatorio['novos'].append(nome)
+            anos_afetados.update(entrada['anos'])
+            arquivos[nome] = entrada
+        for nome in [n for n in arquivos if n not in presentes]:
+            anos_afetados.update(arquivos.pop(nome)['anos']); relatorio['removidos'].append(nome)
+        # Partições mescladas ausentes (primeira execução ou diretório apagado) também são recalculadas
+        for entrada in arquivos.values():
+            anos_afetados.update(a for a in entrada['anos'] if not os.path.isdir(os.path.join(merged_dir, f"Ano_Orcamento={a}")))
+        for ano in sorted(anos_afetados):
+            _rebuild_year(ano, arquivos, store_dir, merged_dir)
+        relatorio['anos_recalculados'] = sorted(anos_afetados)
+        # Remove partições de extratos que não são mais referenciadas
+        referenciadas = {os.path.normpath(e['particao']) for e in arquivos.values()}
+        for caminho in glob.glob(os.path.join(glob.escape(store_dir), 'arquivos', '*.parquet')):
+            if os.path.normpath(os.path.relpath(caminho, store_dir)) not in referenciadas:
+                try: os.remove(caminho)
+                except OSError: pass
+        _save_manifest(store_dir, manifest)
+        return relatorio
+
+
+def load_merged_dataset(merged_dir, versao_dados):
+    # Carrega o dataset mesclado no pandas (modo em memória), com o mesmo esquema compacto do loader
+    info_carga = {'modo': 'incremental', 'versao_dados': versao_dados}
+    if not glob.glob(os.path.join(glob.escape(merged_dir), '**', '*.parquet'), recursive=True):
+        return pd.DataFrame(columns=SNAPSHOT_COLS), [], info_carga
+    tabela = ds.dataset(merged_dir, format='parquet', partitioning='hive').to_table()
+    tabela = tabela.set_column(tabela.schema.get_field_index('Ano_Orcamento'), 'Ano_Orcamento',
+                               tabela.column('Ano_Orcamento').cast(pa.int64()))
+    for col in TESOURO_CATEGORY_COLS:
+        tabela = tabela.set_column(tabela.schema.get_field_index(col), col, pc.dictionary_encode(tabela.column(col)))
+    df_local = _compact_tesouro_frame(tabela.select(SNAPSHOT_COLS).to_pandas(self_destruct=True, split_blocks=True))
+    return df_local, available_years(df_local), info_carga
+
+
+# --- Formatação de Moeda ---
+def format_currency(value):
+    # Valor em reais -> "R$ 1.234,56" (um valor por vez; para colunas use format_currency_column)
+    try:
+        numeric_value = float(value)
+        return f"R$ {numeric_value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    except (ValueError, TypeError):
+        return str(value)
+
+_POTENCIAS_10 = 10 ** np.arange(19, dtype='int64')
+
+def format_currency_column(centavos):
+    # Versão vetorizada para colunas em centavos: mesmo resultado de format_currency(valor / 100).
+    # Os caracteres são montados numa matriz de bytes de largura fixa (alinhada à direita),
+    # com dígitos, separadores e sinal calculados por aritmética inteira sobre a coluna inteira.
+    valores = pd.Series(centavos)
+    nulos = valores.isna().to_numpy()
+    if pd.api.types.is_integer_dtype(valores.dtype) and not nulos.any():
+        inteiros = valores.to_numpy().astype('int64')
+        sinal = inteiros < 0
+    else:
+        numeros = valores.to_numpy(dtype='float64', na_value=np.nan)
+        validos = numeros[~nulos]
+        if not (np.isfinite(validos).all() and np.array_equal(validos, np.round(validos))):
+            # Centavos fracionários (ou infinitos): o arredondamento decimal fica com o formatador escalar
+            return pd.Series([format_currency(v / 100) for v in numeros], index=valores.index, dtype=object)
+        inteiros = np.where(nulos, 0, numeros).astype('int64')
+        sinal = np.signbit(numeros) & ~nulos # como no formatador escalar, -0.0 sai como '-0,00'
+    absolutos = np.abs(inteiros)
+    reais = absolutos // CENTAVOS
+    n_digitos = np.maximum(1, np.searchsorted(_POTENCIAS_10, reais, side='right'))
+    max_digitos = int(n_digitos.max()) if len(n_digitos) else 1
+    largura = 3 + max_digitos + (max_digitos - 1) // 3 + 1
+    matriz = np.full((len(inteiros), largura), ord(' '), dtype=np.uint8)
+    matriz[:, -1] = ord('0') + absolutos % 10
+    matriz[:, -2] = ord('0') + (absolutos // 10) % 10
+    matriz[:, -3] = ord(',')
+    resto = reais.copy()
+    for k in range(max_digitos):
+        pos = largura - 4 - k - k // 3
+        presente = k < n_digitos
+        if k and k % 3 == 0: matriz[presente, pos + 1] = ord('.')
+        matriz[presente, pos] = ord('0') + resto[presente] % 10
+        resto //= 10
+    pos_sinal = largura - 4 - n_digitos - (n_digitos - 1) // 3
+    negativos = np.flatnonzero(sinal)
+    matriz[negativos, pos_sinal[negativos]] = ord('-')
+    texto = np.char.add('R$ ', np.char.lstrip(matriz.view(f'S{largura}').ravel().astype(str)))
+    texto = texto.astype(object)
+    texto[nulos] = 'R$ nan'
+    return pd.Series(texto, index=valores.index)
+
+def format_table(tabela):
+    # Cópia da visão com as colunas de valores (centavos) já formatadas em reais
+    tabela = tabela.copy()
+    for col in VALUE_COLS:
+        if col in tabela.columns: tabela[col] = format_currency_column(tabela[col])
+    return tabela
+
+# --- Detalhe por PO Paginado ---
+# O detalhe é ordenado e filtrado pela busca no servidor (uma vez por estado dos filtros/ordem/busca);
+# só a página visível é formatada e enviada ao navegador.
+DETAIL_PAGE_SIZES = [50, 100, 250, 500]
+DETAIL_DEFAULT_ORDER = ['Acao_Codigo', 'PO_Codigo', 'Fonte_Codigo', 'PTRES']
+# Rótulo -> colunas de ordenação; o critério escolhido vem primeiro e a ordem padrão desempata
+DETAIL_SORT_OPTIONS = {
+    'Ação': ['Acao_Codigo'],
+    'PO': ['PO_Codigo'],
+    'Fonte': ['Fonte_Codigo'],
+    'Dotação': ['Dotacao_Lei_Creditos'],
+    'Empenhado': ['Valor_Empenhado'],
+    'Liquidado': ['Valor_Liquidado'],
+    'Pago': ['Valor_Pago'],
+}
+DETAIL_SEARCH_COLS = ['Acao_Codigo', 'Acao_Nome', 'PO_Codigo', 'PO_Nome', 'Fonte_Codigo']
+
+def sort_po_detail(detalhe, ordenar_por='Ação', crescente=True):
+    colunas = DETAIL_SORT_OPTIONS[ordenar_por]
+    colunas = colunas + [c for c in DETAIL_DEFAULT_ORDER if c not in colunas and c in detalhe.columns]
+    return detalhe.sort_values(by=colunas, ascending=crescente, kind='stable').reset_index(drop=True)
+
+def search_po_detail(detalhe, termo):
+    # Busca sem diferenciar maiúsculas em códigos e nomes de Ação, PO e Fonte (a ordem é mantida).
+    # Nas colunas categóricas o texto é comparado só com o dicionário e mapeado pelos códigos.
+    termo = (termo or '').strip()
+    if not termo or detalhe.empty: return detalhe
+    encontrado = np.zeros(len(detalhe), dtype=bool)
+    for col in DETAIL_SEARCH_COLS:
+        if col not in detalhe.columns: continue
+        valores = detalhe[col]
+        if isinstance(valores.dtype, pd.CategoricalDtype):
+            no_dicionario = valores.cat.categories.astype(str).str.contains(termo, case=False, regex=False)
+            # Posição extra (False) para o código -1 dos nulos
+            encontrado |= np.append(np.asarray(no_dicionario, dtype=bool), False)[valores.cat.codes.to_numpy()]
+        else:
+            encontrado |= valores.astype(str).str.contains(termo, case=False, regex=False).to_numpy(dtype=bool)
+    return detalhe[encontrado].reset_index(drop=True)
+
+def detail_page_count(total_linhas, tamanho_pagina):
+    return max(1, -(-total_linhas // tamanho_pagina))
+
+def format_detail_page(detalhe, pagina, tamanho_pagina):
+    # Página (a partir de 1, limitada ao intervalo válido) já formatada, com a posição da primeira linha
+    pagina = min(max(1, pagina), detail_page_count(len(detalhe), tamanho_pagina))
+    inicio = (pagina - 1) * tamanho_pagina
+    return format_table(detalhe.iloc[inicio:inicio + tamanho_pagina]), inicio
+
+# --- Preparo dos Gráficos ---
+def prepare_bar_data(bar_data):
+    # Dotação por ano em reais; o ano vira texto para o eixo ser categórico
+    bar_data = bar_data.copy()
+    bar_data['Dotacao_Lei_Creditos'] = to_reais(bar_data['Dotacao_Lei_Creditos'])
+    bar_data['Ano_Orcamento'] = bar_data['Ano_Orcamento'].astype(str)
+    return bar_data
+
+def prepare_pie_data(pie_data):
+    pie_data = pie_data.copy()
+    pie_data['Dotacao_Lei_Creditos'] = to_reais(pie_data['Dotacao_Lei_Creditos'])
+    return pie_data
@@ -0,0 +1,149 @@
+# =============================================================================
+# Cliente do modelo de linguagem usado pelo chat do dashboard (sem Streamlit)
+# Interface LLMClient, cliente Gemini, backend local de testes (StubLLMClient) e o
+# consumo do stream com prazo e novas tentativas. Importado pelo COOF.py.
+# =============================================================================
+
+import os
+import threading
+import queue
+import time
+
+# --- Gemini (opcional) ---
+try:
+    import google.generativeai as genai
+    from google.api_core import exceptions as google_exceptions
+    GEMINI_INSTALLED = True
+except ImportError:
+    GEMINI_INSTALLED = False
+
+# Streaming da resposta: prazo total, prazo sem receber nenhum trecho e novas tentativas antes do 1º trecho
+LLM_TIMEOUT = 90 # segundos
+LLM_IDLE_TIMEOUT = 30 # segundos
+LLM_MAX_RETRIES = 2
+LLM_RETRY_BACKOFF = 1.0 # segundos (dobra a cada tentativa)
+# Cliente local sem rede (desenvolvimento/testes): COOF_LLM_STUB=1
+LLM_STUB = os.environ.get('COOF_LLM_STUB', '0') == '1'
+
+class LLMBlockedError(Exception):
+    # Resposta bloqueada pelos filtros de segurança do modelo
+    pass
+
+class LLMTimeoutError(Exception):
+    # O modelo não respondeu dentro do prazo
+    pass
+
+# Erros transitórios que justificam nova tentativa (apenas antes de qualquer trecho ser exibido)
+LLM_RETRYABLE_ERRORS = (LLMTimeoutError,)
+if GEMINI_INSTALLED:
+    LLM_RETRYABLE_ERRORS += (google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded,
+                             google_exceptions.InternalServerError, google_exceptions.ResourceExhausted)
+
+class LLMClient:
+    # Interface do modelo de linguagem usada pelo chat: stream(prompt) -> trechos de texto
+    def stream(self, prompt):
+        raise NotImplementedError
+
+    def generate(self, prompt):
+        return ''.join(self.stream(prompt))
+
+class GeminiClient(LLMClient):
+    # Configurado uma vez por processo (ver get_gemini_client) e reutilizado entre perguntas e sessões
+    def __init__(self, api_key, model_name="gemini-1.5-flash-latest"): # Modelo gratuito geralmente disponível
+        genai.configure(api_key=api_key)
+        # Para segurança, desabilitamos categorias potencialmente problemáticas
+        generation_config = {
+          "temperature": 0.8, # Um pouco mais criativo, ajuste se necessário
+          "top_p": 1,
+          "top_k": 1,
+          "max_output_tokens": 2048,
+        }
+        safety_settings = [
+            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        ]
+        self.model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=generation_config,
+            safety_settings=safety_settings
+        )
+
+    def stream(self, prompt):
+        response = self.model.generate_content(prompt, stream=True, request_options={"timeout": LLM_TIMEOUT})
+        for chunk in response:
+            try:
+                texto = chunk.text
+            except ValueError:
+                # O acessor também falha em trechos sem conteúdo (ex.: só com finish_reason STOP ou
+                # MAX_TOKENS); apenas bloqueio do prompt ou parada por segurança contam como bloqueio
+                if _is_blocked(chunk): raise LLMBlockedError(str(chunk.prompt_feedback))
+                continue
+            if texto: yield texto
+
+def _is_blocked(chunk):
+    feedback = getattr(chunk, 'prompt_feedback', None)
+    if feedback is not None and feedback.block_reason: return True
+    candidatos = getattr(chunk, 'candidates', None)
+    return bool(candidatos) and candidatos[0].finish_reason == genai.protos.Candidate.FinishReason.SAFETY
+
+class StubLLMClient(LLMClient):
+    # Backend local de streaming (sem rede): resposta fixa ou função do prompt, entregue em trechos
+    # com atraso opcional; registra os prompts recebidos
+    def __init__(self, responder=None, chunk_size=16, delay=0.0):
+        self.responder = responder
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.calls = []
+
+    def stream(self, prompt):
+        self.calls.append(prompt)
+        if callable(self.responder): texto = self.responder(prompt)
+        elif self.responder is not None: texto = self.responder
+        else: texto = f"[stub] Contexto recebido com {len(prompt)} caracteres."
+        for i in range(0, len(texto), self.chunk_size):
+            if self.delay: time.sleep(self.delay)
+            yield texto[i:i + self.chunk_size]
+
+def _stream_in_worker(client, prompt, timeout, idle_timeout):
+    # O stream é consumido numa thread auxiliar; a thread do script apenas espera na fila com prazo.
+    # Se o prazo estourar (ou o consumidor desistir), a thread é sinalizada para parar.
+    fila = queue.Queue()
+    cancelado = threading.Event()
+    def produzir():
+        try:
+            for parte in client.stream(prompt):
+                if cancelado.is_set(): return
+                fila.put(('parte', parte))
+            fila.put(('fim', None))
+        except Exception as e:
+            fila.put(('erro', e))
+    threading.Thread(target=produzir, name='coof-llm-stream', daemon=True).start()
+    prazo = time.monotonic() + timeout
+    try:
+        while True:
+            espera = min(idle_timeout, prazo - time.monotonic())
+            if espera <= 0: raise LLMTimeoutError(f"resposta incompleta após {timeout} s")
+            try: tipo, valor = fila.get(timeout=espera)
+            except queue.Empty: raise LLMTimeoutError(f"sem resposta do modelo por {espera:.1f} s")
+            if tipo == 'parte': yield valor
+            elif tipo == 'erro': raise valor
+            else: return
+    finally:
+        cancelado.set()
+
+def stream_with_timeout(client, prompt, timeout=LLM_TIMEOUT, idle_timeout=LLM_IDLE_TIMEOUT, max_retries=LLM_MAX_RETRIES):
+    tentativa = 0
+    while True:
+        recebeu = False
+        try:
+            for parte in _stream_in_worker(client, prompt, timeout, idle_timeout):
+                recebeu = True
+                yield parte
+            return
+        except LLM_RETRYABLE_ERRORS:
+            # Depois do primeiro trecho não há como repetir sem duplicar o texto exibido
+            if recebeu or tentativa >= max_retries: raise
+            tentativa += 1
+            time.sleep(LLM_RETRY_BACKOFF * 2 ** (tentativa - 1))
@@ -0,0 +1,20 @@
+# Utilitários comuns aos testes: extratos pequenos no layout do 'Extrator BI Tesouro'
+import openpyxl
+
+from coof_core import TESOURO_COLS
+
+
+def linha_extrato(ano=2025, acao='2000', po='0000', fonte='1000', empenhado=100.0, dotacao=None,
+                  liquidado=0.0, pago=0.0, ptres='174198', rp='2', gnd='3'):
+    # Uma linha de dados na ordem de TESOURO_COLS
+    return [ano, acao, f"ACAO {acao}", po, f"PO {po}", gnd, rp, f"RP {rp}", fonte, ptres,
+            dotacao if dotacao is not None else empenhado, empenhado, liquidado, pago]
+
+
+def write_extract(path, linhas, cabecalho=(tuple(TESOURO_COLS),)):
+    # Planilha com as linhas de 'cabecalho' (layout antes dos dados) seguidas das linhas de dados
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for linha in list(cabecalho) + list(linhas): ws.append(list(linha))
+    wb.save(path)
+    return path
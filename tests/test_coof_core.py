@@ -0,0 +1,91 @@
+# FilterEngine (índice invertido) comparado com o filtro equivalente via pandas isin
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.bench_pipeline import generate_tesouro_frame
+from coof_core import FILTER_DIMS, FilterEngine
+
+N_LINHAS = 5000
+
+
+@pytest.fixture(scope='module')
+def df_sintetico():
+    df = generate_tesouro_frame(N_LINHAS, seed=7)
+    rng = np.random.default_rng(7)
+    # Códigos nulos (código categórico -1) em Fonte e RP; PO como texto com nulos (caminho do factorize)
+    df.loc[rng.random(N_LINHAS) < 0.05, 'Fonte_Codigo'] = np.nan
+    df.loc[rng.random(N_LINHAS) < 0.05, 'RP_Codigo'] = np.nan
+    df['PO_Codigo'] = df['PO_Codigo'].astype(object)
+    df.loc[rng.random(N_LINHAS) < 0.05, 'PO_Codigo'] = np.nan
+    return df
+
+
+@pytest.fixture(scope='module')
+def engine(df_sintetico):
+    return FilterEngine(df_sintetico)
+
+
+def _esperado(df, selecao):
+    mascara = np.ones(len(df), dtype=bool)
+    for dim, valores in selecao.items():
+        if valores: mascara &= df[dim].isin(valores).to_numpy()
+    return df[mascara]
+
+
+def _valores(df, dim, quantidade, seed):
+    distintos = sorted(df[dim].dropna().unique())
+    return list(np.random.default_rng(seed).choice(np.array(distintos, dtype=object), size=quantidade, replace=False))
+
+
+def _selecoes(df):
+    return {
+        'ano': {'Ano_Orcamento': [2025]},
+        'padrao': {'Ano_Orcamento': [2025], 'RP_Codigo': ['2']},
+        'com_nulos': {'Fonte_Codigo': _valores(df, 'Fonte_Codigo', 5, 1), 'PO_Codigo': _valores(df, 'PO_Codigo', 10, 2)},
+        'todas_dims': {'Ano_Orcamento': [2023, 2024, 2025], 'Fonte_Codigo': _valores(df, 'Fonte_Codigo', 20, 3),
+                       'Acao_Codigo': _valores(df, 'Acao_Codigo', 12, 4), 'PO_Codigo': _valores(df, 'PO_Codigo', 25, 5),
+                       'RP_Codigo': ['1', '2', '6']},
+        'ausentes': {'Ano_Orcamento': [1999, 2025], 'Acao_Codigo': ['9999', _valores(df, 'Acao_Codigo', 1, 6)[0]]},
+        'so_ausentes': {'Acao_Codigo': ['9999'], 'Ano_Orcamento': [2025]},
+        'duplicados': {'RP_Codigo': ['2', '2', '1'], 'Ano_Orcamento': [2025, 2025]},
+        'dim_vazia': {'Ano_Orcamento': [2025], 'Fonte_Codigo': []},
+        'dim_inexistente': {'Ano_Orcamento': [2025], 'Coluna_Inexistente': ['x']},
+    }
+
+
+@pytest.mark.parametrize('nome', ['ano', 'padrao', 'com_nulos', 'todas_dims', 'ausentes', 'so_ausentes',
+                                  'duplicados', 'dim_vazia', 'dim_inexistente'])
+def test_select_materialize_igual_isin(df_sintetico, engine, nome):
+    selecao = _selecoes(df_sintetico)[nome]
+    obtido = engine.materialize(engine.select(selecao))
+    # Dimensões fora do DataFrame não filtram
+    esperado = _esperado(df_sintetico, {dim: v for dim, v in selecao.items() if dim in df_sintetico.columns})
+    pd.testing.assert_frame_equal(obtido, esperado)
+
+
+def test_select_so_ausentes_vazio(engine):
+    linhas = engine.select({'Acao_Codigo': ['9999'], 'Ano_Orcamento': [2025]})
+    assert linhas is not None and len(linhas) == 0
+    assert engine.materialize(linhas).empty
+
+
+@pytest.mark.parametrize('selecao', [{}, {'Ano_Orcamento': []}, {'Ano_Orcamento': [], 'RP_Codigo': []}])
+def test_selecao_vazia_sem_copia(df_sintetico, engine, selecao):
+    assert engine.select(selecao) is None
+    assert engine.materialize(engine.select(selecao)) is df_sintetico
+
+
+@pytest.mark.parametrize('dim', FILTER_DIMS)
+def test_options_igual_unicos_filtrados(df_sintetico, engine, dim):
+    selecoes = _selecoes(df_sintetico)
+    for selecao in [None, selecoes['padrao'], selecoes['com_nulos'], selecoes['todas_dims'], selecoes['so_ausentes']]:
+        filtrado = df_sintetico if selecao is None else _esperado(df_sintetico, selecao)
+        esperado = sorted(filtrado[dim].dropna().unique())
+        assert engine.options(dim, selecao) == esperado
+
+
+def test_options_exclui_nulos(df_sintetico, engine):
+    assert df_sintetico['Fonte_Codigo'].isna().any()
+    assert all(pd.notna(v) for v in engine.options('Fonte_Codigo'))
+    assert all(pd.notna(v) for v in engine.options('PO_Codigo', {'Ano_Orcamento': [2025]}))
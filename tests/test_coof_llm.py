@@ -0,0 +1,119 @@
+# Testes do consumo do stream do modelo (prazo e novas tentativas) com o backend local StubLLMClient
+import time
+
+import pytest
+
+import coof_llm
+from coof_llm import LLMTimeoutError, StubLLMClient, stream_with_timeout
+
+
+class FlakyClient(StubLLMClient):
+    # Falha antes do primeiro trecho nas 'falhas' primeiras chamadas
+    def __init__(self, falhas, **kwargs):
+        super().__init__(**kwargs)
+        self.falhas = falhas
+
+    def stream(self, prompt):
+        if len(self.calls) < self.falhas:
+            self.calls.append(prompt)
+            raise LLMTimeoutError("falha simulada")
+        yield from super().stream(prompt)
+
+
+class StallAfterFirstChunk(StubLLMClient):
+    # Entrega um trecho e depois para de responder
+    def stream(self, prompt):
+        self.calls.append(prompt)
+        yield "primeiro trecho"
+        time.sleep(1.0)
+        yield "nunca exibido"
+
+
+@pytest.fixture(autouse=True)
+def sem_espera_entre_tentativas(monkeypatch):
+    monkeypatch.setattr(coof_llm, 'LLM_RETRY_BACKOFF', 0.0)
+
+
+def test_stream_completo():
+    client = StubLLMClient("resposta do modelo", chunk_size=4)
+    assert ''.join(stream_with_timeout(client, "p", timeout=5, idle_timeout=1)) == "resposta do modelo"
+    assert client.calls == ["p"]
+
+
+def test_timeout_sem_resposta():
+    client = StubLLMClient("lento", delay=1.0)
+    inicio = time.monotonic()
+    with pytest.raises(LLMTimeoutError):
+        list(stream_with_timeout(client, "p", timeout=5, idle_timeout=0.1, max_retries=0))
+    assert time.monotonic() - inicio < 0.9
+
+
+def test_timeout_total():
+    client = StubLLMClient("a" * 100, chunk_size=1, delay=0.05)
+    with pytest.raises(LLMTimeoutError):
+        list(stream_with_timeout(client, "p", timeout=0.3, idle_timeout=1, max_retries=0))
+
+
+def test_nova_tentativa_antes_do_primeiro_trecho():
+    client = FlakyClient(falhas=2, responder="ok depois de falhar")
+    assert ''.join(stream_with_timeout(client, "p", timeout=5, idle_timeout=1, max_retries=2)) == "ok depois de falhar"
+    assert len(client.calls) == 3
+
+
+def test_tentativas_esgotadas():
+    client = FlakyClient(falhas=5, responder="nunca")
+    with pytest.raises(LLMTimeoutError):
+        list(stream_with_timeout(client, "p", timeout=5, idle_timeout=1, max_retries=2))
+    assert len(client.calls) == 3
+
+
+def test_sem_nova_tentativa_depois_do_primeiro_trecho():
+    client = StallAfterFirstChunk()
+    recebidos = []
+    with pytest.raises(LLMTimeoutError):
+        for parte in stream_with_timeout(client, "p", timeout=5, idle_timeout=0.2, max_retries=2):
+            recebidos.append(parte)
+    assert recebidos == ["primeiro trecho"]
+    assert len(client.calls) == 1
+
+
+@pytest.mark.skipif(not coof_llm.GEMINI_INSTALLED, reason="google-generativeai não instalado")
+class TestGeminiBlocked:
+    # Trechos do stream montados com os protos da biblioteca, sem rede
+
+    @staticmethod
+    def _chunk(texto=None, finish_reason=None, block_reason=None):
+        protos = coof_llm.genai.protos
+        from google.generativeai.types import generation_types
+        kwargs = {}
+        if texto is not None or finish_reason is not None:
+            conteudo = protos.Content(parts=[protos.Part(text=texto)], role='model') if texto is not None else None
+            kwargs['candidates'] = [protos.Candidate(content=conteudo, finish_reason=finish_reason or 0)]
+        if block_reason is not None:
+            kwargs['prompt_feedback'] = protos.GenerateContentResponse.PromptFeedback(block_reason=block_reason)
+        return generation_types.GenerateContentResponse.from_response(protos.GenerateContentResponse(**kwargs))
+
+    @staticmethod
+    def _client(chunks):
+        class FakeModel:
+            def generate_content(self, prompt, stream, request_options):
+                return iter(chunks)
+        client = coof_llm.GeminiClient.__new__(coof_llm.GeminiClient)
+        client.model = FakeModel()
+        return client
+
+    def test_trecho_final_sem_conteudo_nao_bloqueia(self):
+        FinishReason = coof_llm.genai.protos.Candidate.FinishReason
+        chunks = [self._chunk("Resposta "), self._chunk("completa."),
+                  self._chunk(finish_reason=FinishReason.STOP), self._chunk(finish_reason=FinishReason.MAX_TOKENS)]
+        assert self._client(chunks).generate("p") == "Resposta completa."
+
+    def test_prompt_bloqueado(self):
+        with pytest.raises(coof_llm.LLMBlockedError):
+            self._client([self._chunk(block_reason=1)]).generate("p")
+
+    def test_parada_por_seguranca(self):
+        FinishReason = coof_llm.genai.protos.Candidate.FinishReason
+        chunks = [self._chunk("Início "), self._chunk(finish_reason=FinishReason.SAFETY)]
+        with pytest.raises(coof_llm.LLMBlockedError):
+            self._client(chunks).generate("p")
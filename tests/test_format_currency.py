@@ -0,0 +1,46 @@
+# format_currency_column (vetorizada, centavos) deve ser idêntica a format_currency(valor / 100)
+import numpy as np
+import pandas as pd
+import pytest
+
+from coof_core import format_currency, format_currency_column
+
+BORDAS = [0, 1, -1, 99, -99, 100, -100, 101, 999_999, 1_000_000, -1_000_000, 123_456_789_012]
+
+
+def _esperado(valores):
+    return [format_currency(v / 100) for v in valores]
+
+
+def test_inteiros_aleatorios_e_bordas():
+    rng = np.random.default_rng(0)
+    valores = np.concatenate([rng.integers(-10**13, 10**13, 5000), rng.integers(-10**4, 10**4, 5000), BORDAS])
+    assert format_currency_column(pd.Series(valores, dtype='int64')).tolist() == _esperado(valores)
+
+
+@pytest.mark.parametrize('dtype', ['int32', 'int64', 'float64', 'Int64'])
+def test_tipos_inteiros_e_float_sem_fracao(dtype):
+    bordas = [v for v in BORDAS if abs(v) < 2**31]
+    assert format_currency_column(pd.Series(bordas, dtype=dtype)).tolist() == _esperado(bordas)
+
+
+def test_nan():
+    valores = pd.Series([np.nan, 150.0, -7.0, np.nan])
+    assert format_currency_column(valores).tolist() == ['R$ nan', 'R$ 1,50', 'R$ -0,07', 'R$ nan']
+    assert format_currency_column(valores).tolist() == _esperado(valores)
+
+
+def test_centavos_fracionarios_arredondam_como_o_escalar():
+    valores = [12345.6, -0.4, 0.5, 1.5, 2.5, -2.5, 12345.5, 99.999, -0.0]
+    assert format_currency_column(pd.Series(valores)).tolist() == _esperado(valores)
+
+
+def test_vazio():
+    resultado = format_currency_column(pd.Series([], dtype='int64'))
+    assert resultado.tolist() == []
+    assert format_currency_column(pd.Series([], dtype='float64')).tolist() == []
+
+
+def test_mantem_o_indice():
+    valores = pd.Series([100, -250], index=[7, 3], dtype='int64')
+    assert list(format_currency_column(valores).index) == [7, 3]
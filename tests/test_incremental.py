@@ -0,0 +1,127 @@
+# Ingestão incremental do diretório de extratos: regra de mesclagem e isolamento de falhas
+import os
+
+import pytest
+
+import coof_core
+from coof_core import load_merged_dataset, refresh_data_dir
+from tests.extratos import linha_extrato, write_extract
+
+
+@pytest.fixture
+def pastas(tmp_path):
+    data_dir = tmp_path / 'extratos'
+    data_dir.mkdir()
+    return str(data_dir), str(tmp_path / 'mesclado'), str(tmp_path / 'store')
+
+
+def _refresh(pastas):
+    return refresh_data_dir(*pastas)
+
+
+def _empenhado(pastas):
+    # {(ano, ação, PO, fonte): empenhado em reais} do dataset mesclado
+    df, _, _ = load_merged_dataset(pastas[1], 'teste')
+    return {(int(r.Ano_Orcamento), r.Acao_Codigo, r.PO_Codigo, r.Fonte_Codigo): r.Valor_Empenhado / 100
+            for r in df.itertuples()}
+
+
+def _mtime(path, ns):
+    os.utime(path, ns=(ns, ns))
+
+
+def test_novo_extrato(pastas):
+    write_extract(os.path.join(pastas[0], 'a.xlsx'), [linha_extrato(acao='2000', empenhado=100),
+                                                      linha_extrato(ano=2024, acao='2000', empenhado=7)])
+    relatorio = _refresh(pastas)
+    assert relatorio['novos'] == ['a.xlsx']
+    assert relatorio['anos_recalculados'] == [2024, 2025]
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 100, (2024, '2000', '0000', '1000'): 7}
+
+
+def test_extrato_mais_recente_vence_na_mesma_chave(pastas):
+    a = write_extract(os.path.join(pastas[0], 'a.xlsx'), [linha_extrato(acao='2000', empenhado=100),
+                                                            linha_extrato(acao='2001', empenhado=5)])
+    _mtime(a, 2_000_000_000_000_000_000)
+    _refresh(pastas)
+    b = write_extract(os.path.join(pastas[0], 'b.xlsx'), [linha_extrato(acao='2000', empenhado=200),
+                                                            linha_extrato(acao='2002', empenhado=9)])
+    _mtime(b, 1_000_000_000_000_000_000) # mais antigo que 'a': perde nas chaves em comum
+    relatorio = _refresh(pastas)
+    assert relatorio['novos'] == ['b.xlsx'] and relatorio['inalterados'] == 1
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 100, (2025, '2001', '0000', '1000'): 5,
+                                  (2025, '2002', '0000', '1000'): 9}
+
+
+def test_empate_de_data_decidido_pelo_nome(pastas):
+    for nome, valor in (('b.xlsx', 200), ('a.xlsx', 100)):
+        _mtime(write_extract(os.path.join(pastas[0], nome), [linha_extrato(empenhado=valor)]), 1_500_000_000_000_000_000)
+    _refresh(pastas)
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 200}
+
+
+def test_toque_mantem_prioridade_e_alteracao_a_renova(pastas):
+    caminho_a = os.path.join(pastas[0], 'a.xlsx')
+    _mtime(write_extract(caminho_a, [linha_extrato(empenhado=100)]), 1_000_000_000_000_000_000)
+    _mtime(write_extract(os.path.join(pastas[0], 'b.xlsx'), [linha_extrato(empenhado=200)]), 2_000_000_000_000_000_000)
+    _refresh(pastas)
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 200}
+    # Só a data muda: nada é recalculado e 'b' continua vencendo
+    _mtime(caminho_a, 3_000_000_000_000_000_000)
+    relatorio = _refresh(pastas)
+    assert relatorio['inalterados'] == 2 and relatorio['anos_recalculados'] == []
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 200}
+    # Um novo extrato recalcula o ano: a prioridade de 'a' continua a da ingestão original
+    _mtime(write_extract(os.path.join(pastas[0], 'c.xlsx'), [linha_extrato(acao='2001', empenhado=9)]), 500_000_000_000_000_000)
+    assert _refresh(pastas)['anos_recalculados'] == [2025]
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 200, (2025, '2001', '0000', '1000'): 9}
+    # Conteúdo alterado: 'a' passa a ser o mais recente
+    _mtime(write_extract(caminho_a, [linha_extrato(empenhado=150)]), 4_000_000_000_000_000_000)
+    relatorio = _refresh(pastas)
+    assert relatorio['alterados'] == ['a.xlsx'] and relatorio['anos_recalculados'] == [2025]
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 150, (2025, '2001', '0000', '1000'): 9}
+
+
+def test_remover_o_vencedor_restaura_o_anterior(pastas):
+    _mtime(write_extract(os.path.join(pastas[0], 'a.xlsx'), [linha_extrato(empenhado=100)]), 1_000_000_000_000_000_000)
+    caminho_b = os.path.join(pastas[0], 'b.xlsx')
+    _mtime(write_extract(caminho_b, [linha_extrato(empenhado=200), linha_extrato(ano=2024, empenhado=1)]),
+           2_000_000_000_000_000_000)
+    _refresh(pastas)
+    os.remove(caminho_b)
+    relatorio = _refresh(pastas)
+    assert relatorio['removidos'] == ['b.xlsx'] and relatorio['anos_recalculados'] == [2024, 2025]
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 100}
+    # Partição do extrato removido é apagada
+    assert len(os.listdir(os.path.join(pastas[2], 'arquivos'))) == 1
+
+
+def test_extrato_invalido_nao_interrompe_os_demais(pastas, monkeypatch):
+    write_extract(os.path.join(pastas[0], 'a.xlsx'), [linha_extrato(empenhado=100)])
+    caminho_b = os.path.join(pastas[0], 'b.xlsx')
+    with open(caminho_b, 'wb') as f: f.write(b'nao e um xlsx')
+    relatorio = _refresh(pastas)
+    assert relatorio['novos'] == ['a.xlsx']
+    assert list(relatorio['erros']) == ['b.xlsx'] and 'BadZipFile' in relatorio['erros']['b.xlsx']
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 100}
+    # O manifesto foi salvo: 'a' não é processado de novo; 'b' é tentado outra vez
+    ingeridos = []
+    original = coof_core._ingest_extract
+    monkeypatch.setattr(coof_core, '_ingest_extract', lambda caminho, *a: ingeridos.append(os.path.basename(caminho)) or original(caminho, *a))
+    relatorio = _refresh(pastas)
+    assert ingeridos == ['b.xlsx'] and relatorio['inalterados'] == 1 and 'b.xlsx' in relatorio['erros']
+
+
+def test_extrato_valido_que_corrompe_mantem_a_versao_anterior(pastas):
+    caminho_b = os.path.join(pastas[0], 'b.xlsx')
+    write_extract(caminho_b, [linha_extrato(empenhado=200)])
+    _refresh(pastas)
+    with open(caminho_b, 'wb') as f: f.write(b'copia incompleta')
+    relatorio = _refresh(pastas)
+    assert 'b.xlsx' in relatorio['erros'] and relatorio['removidos'] == [] and relatorio['anos_recalculados'] == []
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 200}
+    # Quando a cópia termina, o extrato é processado normalmente
+    write_extract(caminho_b, [linha_extrato(empenhado=250)])
+    relatorio = _refresh(pastas)
+    assert relatorio['alterados'] == ['b.xlsx'] and not relatorio['erros']
+    assert _empenhado(pastas) == {(2025, '2000', '0000', '1000'): 250}
@@ -0,0 +1,55 @@
+# Leitura do extrato: conversão de moeda e ingestão em blocos (layout, rejeições, valores)
+import numpy as np
+import pandas as pd
+
+import coof_core
+from coof_core import TESOURO_COLS, _parse_currency
+from tests.extratos import linha_extrato, write_extract
+
+# Título e cabeçalho como no 'Extrator BI' real (dados a partir da linha 5 aqui)
+LAYOUT_EXTRATOR = [('Extrator BI',), (None,), ('Métrica: Movim. Líquido - R$ (Conta Contábil)',), tuple(TESOURO_COLS)]
+
+
+def test_parse_currency_numeros_em_coluna_de_texto():
+    # Células numéricas numa coluna com textos eram tratadas como texto pt-BR ('4457.15' -> 445715)
+    valores, invalidos = _parse_currency(pd.Series([4457.15, '1.234,56', 13000, None, ' 7,5 ', 'abc'], dtype=object))
+    np.testing.assert_allclose(valores.to_numpy(), [4457.15, 1234.56, 13000, np.nan, 7.5, np.nan])
+    assert invalidos.tolist() == [False, False, False, False, False, True]
+
+
+def test_parse_currency_coluna_numerica():
+    valores, invalidos = _parse_currency(pd.Series([1724331, 4457.15, None], dtype=object))
+    np.testing.assert_allclose(valores.to_numpy(), [1724331, 4457.15, np.nan])
+    assert not invalidos.any()
+
+
+def test_parse_currency_somente_texto():
+    valores, invalidos = _parse_currency(pd.Series(['1.234.567,89', '-10,00', '']))
+    np.testing.assert_allclose(valores.to_numpy(), [1234567.89, -10.0, np.nan])
+    assert not invalidos.any()
+
+
+def test_streaming_separa_layout_das_rejeicoes(tmp_path):
+    linhas = [linha_extrato(acao='2000', empenhado=4457.15, dotacao=13000),
+              linha_extrato(acao='2001', empenhado='1.234,56', dotacao='2.000,00'),
+              ['sem ano'] + linha_extrato()[1:],
+              linha_extrato(acao='2002', empenhado='12,3x'),
+              linha_extrato(ano='2024', acao='2003', empenhado=1),
+              ['Total', None, None, None, None, None, None, None, None, None, 15000, 5692.71, 0, 0]]
+    caminho = write_extract(str(tmp_path / 'extrato.xlsx'), linhas, cabecalho=LAYOUT_EXTRATOR)
+    destino = str(tmp_path / 'extrato.parquet')
+    info = coof_core._stream_tesouro_excel(caminho, destino, chunk_rows=2)
+    assert info == {'modo': 'streaming', 'linhas_lidas': 5, 'linhas_layout': 5,
+                    'rejeitadas_ano': 1, 'rejeitadas_moeda': 1}
+    df, info_lido = coof_core.read_tesouro_parquet(destino)
+    assert info_lido == info
+    assert df['Ano_Orcamento'].tolist() == [2025, 2025, 2024]
+    assert df['Acao_Codigo'].astype(str).tolist() == ['2000', '2001', '2003']
+    assert df['Valor_Empenhado'].tolist() == [445715, 123456, 100]
+    assert df['Saldo_a_Empenhar'].tolist() == [1300000 - 445715, 200000 - 123456, 0]
+
+
+def test_streaming_sem_layout(tmp_path):
+    caminho = write_extract(str(tmp_path / 'so_dados.xlsx'), [linha_extrato(empenhado=1)], cabecalho=())
+    info = coof_core._stream_tesouro_excel(caminho, str(tmp_path / 'so_dados.parquet'))
+    assert (info['linhas_lidas'], info['linhas_layout'], info['rejeitadas_ano']) == (1, 0, 0)
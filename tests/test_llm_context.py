@@ -0,0 +1,74 @@
+# Testes do montador de contexto do chat (orçamento de caracteres e top-N), sem Streamlit
+import numpy as np
+import pandas as pd
+import pytest
+
+import coof_core
+from coof_core import CubeBackend, build_llm_context, describe_selection, normalize_prompt
+
+
+def _extrato(n_acoes=30, pos_por_acao=3):
+    # Extrato pequeno no esquema tratado: valores em centavos, empenho decrescente por Ação
+    linhas = []
+    for a in range(n_acoes):
+        for p in range(pos_por_acao):
+            empenhado = (n_acoes - a) * 1_000_000 + p
+            linhas.append({'Ano_Orcamento': 2025, 'Acao_Codigo': f"A{a:03d}", 'Acao_Nome': f"ACAO {a}",
+                           'PO_Codigo': f"{p:04d}", 'PO_Nome': f"PO {a}-{p}", 'Fonte_Codigo': '1000',
+                           'PTRES': '100000', 'RP_Codigo': '2', 'GND_Codigo': '3',
+                           'Dotacao_Lei_Creditos': empenhado * 2, 'Valor_Empenhado': empenhado,
+                           'Valor_Liquidado': empenhado // 2, 'Valor_Pago': empenhado // 4,
+                           'Saldo_Empenho': empenhado - empenhado // 2, 'Saldo_a_Empenhar': empenhado})
+    df = pd.DataFrame(linhas)
+    for col in coof_core.VALUE_COLS: df[col] = df[col].astype(np.int64)
+    return df
+
+
+@pytest.fixture(scope='module')
+def visoes():
+    backend = CubeBackend(_extrato())
+    selecao = {'Ano_Orcamento': [2025], 'RP_Codigo': ['2']}
+    return {v: backend.view(v, selecao) for v in ('totais', 'acao', 'po')}, selecao
+
+
+def _contexto(visoes, **kwargs):
+    v, selecao = visoes
+    return build_llm_context(v['totais'], v['acao'], v['po'], selecao, **kwargs)
+
+
+def test_cabecalho_com_filtros_e_totais(visoes):
+    contexto = _contexto(visoes)
+    linhas = contexto.splitlines()
+    assert linhas[0] == "Filtros ativos: Ano Orçamento: 2025; Fonte: todos; Ação: todos; PO: todos; RP: 2"
+    assert linhas[1] == "Registros no extrato filtrado: 90"
+    assert linhas[2].startswith("Totais: Dotação R$ ")
+
+
+@pytest.mark.parametrize('max_chars', [800, 1500, 3500, 20000])
+def test_respeita_o_orcamento(visoes, max_chars):
+    assert len(_contexto(visoes, max_chars=max_chars)) <= max_chars
+
+
+def test_top_n_com_folga(visoes):
+    contexto = _contexto(visoes, max_chars=100_000, top_n=5)
+    assert "Execução por Ação (5 de 30" in contexto
+    assert "Execução por PO (5 de 90" in contexto
+    # Maiores empenhos primeiro
+    assert contexto.index("A000 | ACAO 0 |") < contexto.index("A001 | ACAO 1 |")
+    assert "A005 | ACAO 5 |" not in contexto
+
+
+def test_top_n_reduzido_ate_caber(visoes):
+    contexto = _contexto(visoes, max_chars=1500, top_n=16)
+    # 16 não cabe: o top-N é reduzido pela metade até caber, mantendo as seções completas
+    assert "Execução por Ação (4 de 30" in contexto
+    assert "Execução por PO (4 de 90" in contexto
+    assert contexto.splitlines()[-1].endswith("Pago R$ 72.500,00")
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  Qual o TOTAL\n empenhado? ") == "qual o total empenhado?"
+
+
+def test_describe_selection_vazia():
+    assert describe_selection({}) == "Ano Orçamento: todos; Fonte: todos; Ação: todos; PO: todos; RP: todos"